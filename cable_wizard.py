@@ -34,6 +34,7 @@ import bpy
 from bpy.types import Menu, Panel, Operator
 import random
 from mathutils import Vector
+import numpy
 from numpy import mean
 from math import sqrt
 
@@ -160,43 +161,43 @@ class VIEW3D_OT_cable_wizard(Operator):
         rnd2 = rnd_point2.co
         return (rnd1, rnd2)
 
-    def get_vertex_points(self, context):
+    def get_vertex_group_points(self, context):
+        # world space positions of all vertices in our group,
+        # collected once per run instead of scanning the mesh for every cable
         ob = context.active_object
-        scene = context.scene
-        v_group = ob.vertex_groups[scene.vertex_group]
-        group_list = []
-        group_index = v_group.index
+        mesh = ob.data
+        group_index = ob.vertex_groups[context.scene.vertex_group].index
         # find the vertices that are part of our group
-        for v in ob.data.vertices:
-            for g in v.groups:
-                if g.group == group_index:
-                    group_list.append(v)
-        rnd1 = random.choice(group_list)
-        rnd2 = random.choice(group_list)
-
-        # defining w is needed to get a valid vector point for the curve vertices
-        w = 1
-        normal_local = rnd1.normal.to_4d()
-        normal_local.w = 0
-        normal_local = (ob.matrix_world * normal_local).to_3d()
-
-        # get the absolute positions of the two random vertices
-        pos = ob.matrix_world
-        rnd1 = pos * rnd1.co
-        rnd2 = pos * rnd2.co
-        return (rnd1, rnd2)
+        indices = numpy.array(
+            [v.index for v in mesh.vertices if any(g.group == group_index for g in v.groups)],
+            dtype=numpy.int64)
+
+        co = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+        mesh.vertices.foreach_get("co", co)
+
+        matrix = numpy.array(ob.matrix_world, dtype=numpy.float64)
+        return co.reshape(-1, 3)[indices].dot(matrix[:3, :3].T) + matrix[:3, 3]
 
     def execute(self, context):
         ob = context.active_object
+        use_vertices = context.object.cable_source == "VERTEX"
+        if use_vertices:
+            positions = self.get_vertex_group_points(context)
+            # the first "available" entries of pool are the vertices that can still be picked
+            pool = numpy.arange(len(positions))
+            available = len(pool)
         i=0
         while i < self.iterations:
             thickness = self.thickness + self.random_thickness * random.uniform(-1,1)
             if context.object.cable_source == "GREASE":
-                rnd1 = self.get_grease_points(context)[0]
-                rnd2 = self.get_grease_points(context)[1]
-            elif context.object.cable_source == "VERTEX":
-                rnd1 = self.get_vertex_points(context)[0]
-                rnd2 = self.get_vertex_points(context)[1]
+                rnd1, rnd2 = self.get_grease_points(context)
+            elif use_vertices:
+                if available < 2:
+                    self.report({'WARNING'}, "Not enough vertices left in the vertex group")
+                    break
+                pick = numpy.random.randint(available, size=2)
+                rnd1 = positions[pool[pick[0]]]
+                rnd2 = positions[pool[pick[1]]]
 
             distance = sqrt((rnd1[0]-rnd2[0])**2 + (rnd1[1]-rnd2[1])**2 +(rnd1[2]-rnd2[2])**2)
             if not distance < self.min_length and not distance > self.max_length:
@@ -204,12 +205,11 @@ class VIEW3D_OT_cable_wizard(Operator):
                 # now that we know the positions, create the cables
                 self.make_poly_line(vector_list, thickness)
                 # try to avoid creating the same curve twice during one iteration
-                if self.prevent_double is True:
-                    try:
-                        point_list.remove(rnd1)
-                        point_list.remove(rnd2)
-                    except:
-                        pass
+                if self.prevent_double is True and use_vertices:
+                    # move the used vertices behind the available ones, the higher position first
+                    for p in sorted(set(pick), reverse=True):
+                        available -= 1
+                        pool[p], pool[available] = pool[available], pool[p]
             i+=1
         return {'FINISHED'}
 
@@ -1,20 +1,85 @@
 """
 This will allow you to choose which GPUs to use with Commandline Rendering.
-Launch Blender with the script like this: 
+Launch Blender with the script like this:
 
-$ blender -b -P enable_gpus.py blendfile.blend -a
+$ blender -b blendfile.blend -P enable_gpus.py -a
+
+Options can be passed after "--":
+
+$ blender -b blendfile.blend -P enable_gpus.py -a -- --device-type CUDA --devices 0,1
+$ blender -b blendfile.blend -P enable_gpus.py -a -- --cpu-only
+$ blender -b -P enable_gpus.py -- --device-type OPTIX --list-devices
+
+Settings can be stored as named profiles in enable_gpus.json next to the script
+(or the file given with --config) and used on every machine that shares it:
+
+$ blender -b -P enable_gpus.py -- --device-type CUDA --filter 3080 --threads 4 --save-profile farm
+$ blender -b blendfile.blend -P enable_gpus.py -a -- --profile farm
+
+Use --dry-run without -a to print the devices, threads and tile size that would be used.
+
+--benchmark renders a crop of the scene with every GPU alone, all GPUs, all GPUs with the CPU
+and the CPU with different threads and tile sizes, and stores the seconds per sample of every
+combination for this machine in enable_gpus_benchmark.json. --auto uses the fastest one:
+
+$ blender -b blendfile.blend -P enable_gpus.py -a -- --auto
 
 """
+import os
+import sys
+import json
+import time
+import socket
+import argparse
 import bpy
 
 
-def enable_gpus(device_type, use_cpus=False, filter_by_name=None):
+# prefix of the line with the device list, so that other scripts can find it in Blender's output
+DEVICES_PREFIX = "ENABLE_GPUS_DEVICES:"
+# profiles are stored next to the script by default
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "enable_gpus.json")
+DEFAULT_BENCHMARK_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "enable_gpus_benchmark.json")
+# tile sizes the benchmark tries for CPU rendering
+CPU_TILE_SIZES = (16, 32, 64)
+CYCLES_X_TILE_SIZES = (256, 1024, 2048)
+# the options a profile can store
+PROFILE_KEYS = ("device_type", "devices", "filter", "use_cpus", "cpu_only", "threads", "tile_size")
+
+
+def select_devices(devices, use_cpus=False, filter_by_name=None, device_indices=None):
+    """
+    Return a list of (device, use) pairs without changing the devices.
+    filter_by_name can be one name or a list of names.
+    """
+    if isinstance(filter_by_name, str):
+        filter_by_name = [filter_by_name]
+
+    selection = []
+    gpu_index = 0
+    for device in devices:
+        if device.type == "CPU":
+            selection.append((device, use_cpus))
+            continue
+        use = True
+        # disable devices that don't match the filter_by_name
+        if filter_by_name and not any(name in device.name for name in filter_by_name):
+            use = False
+        # disable GPUs that are not in device_indices
+        if device_indices is not None and gpu_index not in device_indices:
+            use = False
+        selection.append((device, use))
+        gpu_index += 1
+    return selection
+
+
+def enable_gpus(device_type, use_cpus=False, filter_by_name=None, device_indices=None):
     """
     Enable GPU rendering and configure GPUs.
 
     device_type: OPTIX or CUDA
     use_cpus: render with GPUs AND CPUS
-    filter_by_name: Choose GPU(s) by name, e.g. "1080" or "3080"
+    filter_by_name: Choose GPU(s) by name, e.g. "1080" or "3080", or a list of names
+    device_indices: Choose GPU(s) by their index in the device list, e.g. [0, 2]
     """
 
     preferences = bpy.context.preferences
@@ -26,15 +91,8 @@ def enable_gpus(device_type, use_cpus=False, filter_by_name=None):
     # OPTIX or CUDA?
     cycles_preferences.compute_device_type = device_type
 
-    for device in devices:
-        # first activate all devices
-        device.use = True
-        # disable devices that don't match the filter_by_name
-        if filter_by_name and filter_by_name not in device.name:
-            device.use = False
-        # disable CPU if necessary
-        if device.type == "CPU":
-            device.use = use_cpus
+    for device, use in select_devices(devices, use_cpus, filter_by_name, device_indices):
+        device.use = use
 
     # return activated devices for printing to check if everything worked
     activated_devices = [d.name for d in devices if d.use]
@@ -42,4 +100,340 @@ def enable_gpus(device_type, use_cpus=False, filter_by_name=None):
     return activated_devices
 
 
-print(enable_gpus("OPTIX", filter_by_name="3080"))
+def enable_cpu():
+    """
+    Render on the CPU only. The number of threads is set with Blender's -t option.
+    """
+    bpy.context.scene.cycles.device = "CPU"
+    return ["CPU"]
+
+
+def list_devices(device_type):
+    """
+    Return name, type and index of all devices of device_type. The index is the one used by device_indices.
+    """
+    devices = bpy.context.preferences.addons["cycles"].preferences.get_devices_for_type(device_type)
+    device_list = []
+    gpu_index = 0
+    for device in devices:
+        index = None
+        if device.type != "CPU":
+            index = gpu_index
+            gpu_index += 1
+        device_list.append({"name": device.name, "type": device.type, "id": device.id, "index": index})
+    return device_list
+
+
+def set_threads(threads):
+    """
+    Render with a fixed number of threads, 0 lets Blender detect them.
+    """
+    render = bpy.context.scene.render
+    render.threads_mode = "FIXED" if threads else "AUTO"
+    if threads:
+        render.threads = threads
+
+
+def set_tile_size(tile_size):
+    """
+    Set the tile size for Cycles X (Blender 3.0+) and for older versions.
+    """
+    scene = bpy.context.scene
+    if hasattr(scene.cycles, "tile_size"):
+        scene.cycles.use_auto_tile = True
+        scene.cycles.tile_size = tile_size
+    else:
+        scene.render.tile_x = tile_size
+        scene.render.tile_y = tile_size
+
+
+def load_profiles(config_path):
+    if not os.path.exists(config_path):
+        return {}
+    with open(config_path) as f:
+        return json.load(f).get("profiles", {})
+
+
+def save_profile(config_path, name, args):
+    config = {}
+    if os.path.exists(config_path):
+        with open(config_path) as f:
+            config = json.load(f)
+    config.setdefault("profiles", {})[name] = {key: getattr(args, key) for key in PROFILE_KEYS}
+    with open(config_path, "w") as f:
+        json.dump(config, f, indent=4, sort_keys=True)
+
+
+def print_plan(config):
+    """
+    Print which devices, threads and tile size a profile or benchmark result would use, without changing anything.
+    """
+    print("Scene: %s" % bpy.context.scene.name)
+    if config.get("cpu_only"):
+        print("Device: CPU")
+    else:
+        device_type = config.get("device_type", "OPTIX")
+        print("Device: GPU (%s)" % device_type)
+        devices = bpy.context.preferences.addons["cycles"].preferences.get_devices_for_type(device_type)
+        for device, use in select_devices(devices, config.get("use_cpus", False), config.get("filter"), config.get("devices")):
+            print("    [%s] %s (%s)" % ("x" if use else " ", device.name, device.type))
+    print("Threads: %s" % (config.get("threads") or "auto"))
+    print("Tile size: %s" % (config.get("tile_size") or "unchanged"))
+
+
+def apply_config(config):
+    """
+    Enable the devices, threads and tile size of a profile or benchmark result.
+    """
+    if config.get("cpu_only"):
+        activated_devices = enable_cpu()
+    else:
+        activated_devices = enable_gpus(
+            config.get("device_type", "OPTIX"), config.get("use_cpus", False),
+            config.get("filter"), config.get("devices"))
+    if config.get("threads"):
+        set_threads(config["threads"])
+    if config.get("tile_size"):
+        set_tile_size(config["tile_size"])
+    return activated_devices
+
+
+# ###########################################
+# BENCHMARK #################################
+# ###########################################
+
+def machine_key(device_type):
+    """
+    Benchmark results are only valid for the same machine, Blender version and devices.
+    """
+    devices = bpy.context.preferences.addons["cycles"].preferences.get_devices_for_type(device_type)
+    signature = ",".join(sorted("%s:%s" % (d.type, d.name) for d in devices))
+    return "%s|%s|%s" % (socket.gethostname(), bpy.app.version_string, signature)
+
+
+def load_benchmarks(cache_path):
+    if not os.path.exists(cache_path):
+        return {}
+    with open(cache_path) as f:
+        return json.load(f)
+
+
+def save_benchmark(cache_path, key, entry):
+    benchmarks = load_benchmarks(cache_path)
+    benchmarks[key] = entry
+    # write to a temporary file first, the cache may be shared by several machines
+    temp_path = cache_path + ".%s.tmp" % socket.gethostname()
+    with open(temp_path, "w") as f:
+        json.dump(benchmarks, f, indent=4, sort_keys=True)
+    os.replace(temp_path, cache_path)
+
+
+def benchmark_candidates(device_type, use_filter=None, threads=None, tile_sizes=None):
+    """
+    Return the configurations to benchmark: every GPU alone, all GPUs together, all GPUs with the CPU
+    and the CPU alone with different thread counts and tile sizes.
+    On a machine without GPUs only the CPU configurations are returned.
+    """
+    devices = bpy.context.preferences.addons["cycles"].preferences.get_devices_for_type(device_type)
+    gpus = [d for d in devices if d.type != "CPU"]
+    gpu_indices = [i for i, (device, use) in enumerate(select_devices(gpus, filter_by_name=use_filter)) if use]
+    cores = os.cpu_count() or 1
+    if threads is None:
+        threads = sorted(set([cores, max(1, cores // 2)]), reverse=True)
+    if tile_sizes is None:
+        tile_sizes = CYCLES_X_TILE_SIZES if hasattr(bpy.context.scene.cycles, "tile_size") else CPU_TILE_SIZES
+
+    candidates = []
+    gpu = {"device_type": device_type, "cpu_only": False, "use_cpus": False, "threads": 0, "tile_size": 0}
+    if len(gpu_indices) > 1:
+        for index in gpu_indices:
+            candidates.append(dict(gpu, devices=[index]))
+    if gpu_indices:
+        candidates.append(dict(gpu, devices=gpu_indices))
+        candidates.append(dict(gpu, devices=gpu_indices, use_cpus=True))
+    for thread_count in threads:
+        for tile_size in tile_sizes:
+            candidates.append({"cpu_only": True, "threads": thread_count, "tile_size": tile_size})
+    return candidates
+
+
+def describe_config(config):
+    if config.get("cpu_only"):
+        return "CPU, %d threads, tile %d" % (config["threads"], config["tile_size"])
+    devices = ",".join(str(i) for i in config["devices"])
+    return "%s %s%s" % (config["device_type"], devices, " + CPU" if config["use_cpus"] else "")
+
+
+def timed_render(samples):
+    bpy.context.scene.cycles.samples = samples
+    start = time.perf_counter()
+    bpy.ops.render.render()
+    return time.perf_counter() - start
+
+
+def measure_config(config, sample_counts):
+    """
+    Return the seconds per sample of a configuration.
+    Two renders with different sample counts cancel out the time for loading and syncing the scene,
+    a render with one sample before them compiles the kernels.
+    """
+    apply_config(config)
+    low, high = sample_counts
+    timed_render(1)
+    low_time = timed_render(low)
+    high_time = timed_render(high)
+    return max(high_time - low_time, 0.0) / (high - low), low_time
+
+
+class BenchmarkScene:
+    """
+    Render a centered crop without adaptive sampling and restore the scene afterwards.
+    """
+    def __init__(self, scene, crop):
+        self.scene = scene
+        self.crop = crop
+        self.properties = [
+            (scene.render, "use_border"), (scene.render, "use_crop_to_border"),
+            (scene.render, "border_min_x"), (scene.render, "border_max_x"),
+            (scene.render, "border_min_y"), (scene.render, "border_max_y"),
+            (scene.render, "threads_mode"), (scene.render, "threads"),
+            (scene.cycles, "device"), (scene.cycles, "samples"),
+            (scene.cycles, "use_adaptive_sampling"), (scene.cycles, "time_limit"),
+            (scene.cycles, "use_auto_tile"), (scene.cycles, "tile_size"),
+            (scene.render, "tile_x"), (scene.render, "tile_y"),
+        ]
+        self.properties = [(owner, name) for owner, name in self.properties if hasattr(owner, name)]
+
+    def __enter__(self):
+        self.values = [getattr(owner, name) for owner, name in self.properties]
+        render = self.scene.render
+        render.use_border = True
+        render.use_crop_to_border = True
+        render.border_min_x = render.border_min_y = 0.5 - self.crop / 2
+        render.border_max_x = render.border_max_y = 0.5 + self.crop / 2
+        for name in ("use_adaptive_sampling", "time_limit"):
+            if hasattr(self.scene.cycles, name):
+                setattr(self.scene.cycles, name, 0)
+        return self
+
+    def __exit__(self, *args):
+        for (owner, name), value in zip(self.properties, self.values):
+            setattr(owner, name, value)
+
+
+def run_benchmark(args):
+    scene = bpy.context.scene
+    candidates = benchmark_candidates(args.device_type, args.filter)
+    results = []
+    with BenchmarkScene(scene, args.benchmark_crop):
+        for config in candidates:
+            try:
+                seconds_per_sample, overhead = measure_config(config, args.benchmark_samples)
+            except (RuntimeError, TypeError) as error:
+                # e.g. a device that fails to compile its kernels
+                print("%s: failed (%s)" % (describe_config(config), error))
+                continue
+            print("%s: %.4f s/sample" % (describe_config(config), seconds_per_sample))
+            results.append({"config": config, "seconds_per_sample": seconds_per_sample, "overhead": overhead})
+    if not results:
+        return None
+    results.sort(key=lambda r: r["seconds_per_sample"])
+    entry = {
+        "file": bpy.data.filepath,
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "results": results,
+        "best": results[0]["config"],
+    }
+    save_benchmark(args.benchmark_cache, machine_key(args.device_type), entry)
+    print("Fastest: %s" % describe_config(entry["best"]))
+    return entry
+
+
+def best_config(args, benchmark=True):
+    """
+    Return the fastest configuration of this machine, run the benchmark if there is none yet.
+    """
+    entry = load_benchmarks(args.benchmark_cache).get(machine_key(args.device_type))
+    if entry is None and benchmark:
+        entry = run_benchmark(args)
+    return entry["best"] if entry else None
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(prog="blender -b -P enable_gpus.py --", description="Choose the devices for Cycles rendering")
+    parser.add_argument("--device-type", default="OPTIX", help="OPTIX, CUDA, HIP, ONEAPI or METAL")
+    parser.add_argument("--devices", type=lambda s: [int(i) for i in s.split(",")], help="comma separated GPU indices, e.g. 0,1")
+    parser.add_argument("--filter", action="append", help="only use GPUs with this in their name, e.g. 3080. Can be repeated")
+    parser.add_argument("--use-cpus", action="store_true", help="render with the GPUs AND the CPU")
+    parser.add_argument("--cpu-only", action="store_true", help="render on the CPU only")
+    parser.add_argument("--threads", type=int, default=0, help="number of render threads, 0 for auto")
+    parser.add_argument("--tile-size", type=int, default=0, help="tile size in pixels, 0 keeps the scene setting")
+    parser.add_argument("--profile", help="use the settings of a profile from the config file")
+    parser.add_argument("--save-profile", metavar="NAME", help="store the given settings as a profile in the config file")
+    parser.add_argument("--config", default=DEFAULT_CONFIG, help="profile config file")
+    parser.add_argument("--dry-run", action="store_true", help="only print the devices, threads and tile size")
+    parser.add_argument("--list-devices", action="store_true", help="print the available devices as JSON")
+    parser.add_argument("--benchmark", action="store_true", help="measure all device combinations and store the results")
+    parser.add_argument("--auto", action="store_true", help="use the fastest configuration of this machine, benchmark if needed")
+    parser.add_argument("--benchmark-cache", default=DEFAULT_BENCHMARK_CACHE, help="file with the benchmark results")
+    parser.add_argument("--benchmark-crop", type=float, default=0.25, help="size of the rendered crop, 0-1")
+    parser.add_argument(
+        "--benchmark-samples", type=lambda s: [int(i) for i in s.split(",")], default=[16, 64],
+        help="the two sample counts to compare, e.g. 16,64")
+    args = parser.parse_args(argv)
+    samples = args.benchmark_samples
+    if len(samples) != 2 or samples[0] >= samples[1]:
+        parser.error("--benchmark-samples needs two increasing sample counts")
+    if args.profile:
+        profiles = load_profiles(args.config)
+        if args.profile not in profiles:
+            parser.error("profile %s not found in %s" % (args.profile, args.config))
+        # parse again without defaults to find the options given on the command line, they win over the profile
+        parser.set_defaults(**{key: None for key in PROFILE_KEYS})
+        given = parser.parse_args(argv)
+        for key, value in profiles[args.profile].items():
+            if key in PROFILE_KEYS and getattr(given, key) is None:
+                setattr(args, key, value)
+    return args
+
+
+def main(argv):
+    args = parse_arguments(argv)
+    if args.list_devices:
+        print(DEVICES_PREFIX + json.dumps(list_devices(args.device_type)))
+        return
+    if args.save_profile:
+        save_profile(args.config, args.save_profile, args)
+        print("Saved profile %s to %s" % (args.save_profile, args.config))
+    config = {key: getattr(args, key) for key in PROFILE_KEYS}
+    if args.dry_run:
+        # nothing is rendered or changed, --auto only looks at the stored benchmark results
+        if args.auto:
+            best = best_config(args, benchmark=False)
+            if best is None:
+                print("No benchmark results for this machine, --auto would run the benchmark first")
+            else:
+                print("Fastest configuration: %s" % describe_config(best))
+                config = best
+        print_plan(config)
+        return
+
+    if args.benchmark:
+        run_benchmark(args)
+    if args.auto:
+        best = best_config(args)
+        if best is None:
+            print("No benchmark results, using the given settings")
+        else:
+            print("Fastest configuration: %s" % describe_config(best))
+            config = best
+
+    # Blender loads the .blend given after the script only after the script ran,
+    # so the scene settings would be set on the startup file and lost
+    if not bpy.data.filepath and any(config.get(key) for key in ("cpu_only", "threads", "tile_size")):
+        print("Warning: no .blend file is open, pass it before -P so threads, tile size and CPU rendering apply to it")
+    print(apply_config(config))
+
+
+if __name__ == "__main__":
+    main(sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else [])
@@ -1,72 +1,192 @@
 import bpy
+import numpy as np
 from bpy.types import Menu, Operator, Panel
 
 
+def build_animated_index():
+    """ find all datablocks the Action Starter triggers """
+    index = []
+    # OBJECTS
+    for ob in bpy.data.objects:
+        if ob.pass_index == 10:
+            continue
+        index.append(ob)
+    # LAMPS
+    index.extend(bpy.data.lights)
+    # SHAPEKEYS
+    for me in list(bpy.data.meshes) + list(bpy.data.curves):
+        if me.shape_keys:
+            index.append(me.shape_keys)
+    # SHADERNODES
+    for ob in bpy.data.objects:
+        if not ob.type == 'MESH':
+            continue
+        for mat in ob.data.materials:
+            if mat and mat.use_nodes and mat.node_tree not in index:
+                index.append(mat.node_tree)
+    # animation data is checked when triggering, so datablocks animated later are found too
+    return index
+
+
+# the animated datablocks, built once and thrown away when the scene changes
+animated_index = None
+
+
+def get_animated_index():
+    global animated_index
+    if animated_index is not None:
+        # a removed datablock raises ReferenceError, check before anything is changed
+        try:
+            for id_data in animated_index:
+                id_data.name
+        except ReferenceError:
+            animated_index = None
+    if animated_index is None:
+        animated_index = build_animated_index()
+    return animated_index
+
+
+def reset_animated_index(*args):
+    global animated_index
+    animated_index = None
+
+
+# datablocks whose changes can add or remove animated datablocks
+INDEX_TYPES = (bpy.types.Object, bpy.types.Light, bpy.types.Mesh, bpy.types.Curve,
+    bpy.types.Key, bpy.types.Material, bpy.types.NodeTree, bpy.types.Collection)
+
+
+def index_update_handler(scene, depsgraph):
+    """ rebuild the index after edits, moving objects around doesn't change it """
+    for update in depsgraph.updates:
+        if isinstance(update.id, INDEX_TYPES) and not update.is_updated_transform:
+            reset_animated_index()
+            return
+
+
+def collect_actions():
+    """ find the actions of all triggered datablocks, each action only once """
+    actions = []
+    for id_data in get_animated_index():
+        anim = id_data.animation_data
+        if anim and anim.action and anim.action not in actions:
+            actions.append(anim.action)
+    return actions
+
+
+def retime_actions(actions, frame, keep_offsets=False):
+    """ move the keyframes of all actions to the frame in one go.
+    By default every key lands on the frame, with keep_offsets the actions are
+    shifted so their first key lands on the frame. Handles move with their keys. """
+    fcurves = [fcurve for action in actions for fcurve in action.fcurves]
+    counts = np.array([len(fcurve.keyframe_points) for fcurve in fcurves], dtype=np.int64)
+    total = int(counts.sum())
+    if not total:
+        return
+    ends = np.cumsum(counts) * 2
+    starts = ends - counts * 2
+
+    # read all keyframes into one array per property
+    buffers = {prop: np.empty(total * 2, dtype=np.float32) for prop in ("co", "handle_left", "handle_right")}
+    for fcurve, start, end in zip(fcurves, starts, ends):
+        for prop, buffer in buffers.items():
+            fcurve.keyframe_points.foreach_get(prop, buffer[start:end])
+
+    x = buffers["co"][0::2]
+    if keep_offsets:
+        # the action of every key, to find the first key of each action
+        fcurve_action = [i for i, action in enumerate(actions) for fcurve in action.fcurves]
+        owner = np.repeat(fcurve_action, counts)
+        first = np.full(len(actions), np.inf, dtype=np.float32)
+        np.minimum.at(first, owner, x)
+        delta = frame - first[owner]
+    else:
+        delta = frame - x
+    for buffer in buffers.values():
+        buffer[0::2] += delta
+
+    for fcurve, start, end in zip(fcurves, starts, ends):
+        for prop, buffer in buffers.items():
+            fcurve.keyframe_points.foreach_set(prop, buffer[start:end])
+        fcurve.update()
+    for action in actions:
+        action.update_tag()
+
+
+# name of the NLA tracks holding the triggered strips
+TRIGGER_TRACK = "VP Trigger"
+
+
+def trigger_source(id_data):
+    """ the action an NLA trigger plays, it is moved out of the active action on the first trigger """
+    anim = id_data.animation_data
+    if not anim:
+        return None
+    if anim.action:
+        id_data["vp_trigger_action"] = anim.action.name
+        anim.action = None
+    return bpy.data.actions.get(id_data.get("vp_trigger_action", ""))
+
+
+def schedule_triggers(frame):
+    """ start the actions of all triggered datablocks at the frame with NLA strips.
+    Earlier triggers keep playing, overlapping strips go to an additional track. """
+    for id_data in get_animated_index():
+        action = trigger_source(id_data)
+        if not action:
+            continue
+        tracks = id_data.animation_data.nla_tracks
+        for track in tracks:
+            if not track.name.startswith(TRIGGER_TRACK):
+                continue
+            try:
+                track.strips.new(action.name, int(frame), action)
+                break
+            except RuntimeError:
+                # the track already plays another trigger at this frame
+                continue
+        else:
+            track = tracks.new()
+            track.name = TRIGGER_TRACK
+            track.strips.new(action.name, int(frame), action)
+
+
+def clear_triggers():
+    """ remove all triggered strips and make the actions active again """
+    for id_data in get_animated_index():
+        anim = id_data.animation_data
+        if not anim:
+            continue
+        for track in [t for t in anim.nla_tracks if t.name.startswith(TRIGGER_TRACK)]:
+            anim.nla_tracks.remove(track)
+        if "vp_trigger_action" in id_data:
+            anim.action = bpy.data.actions.get(id_data["vp_trigger_action"])
+            del id_data["vp_trigger_action"]
+
+
 class VP_OT_action_starter(Operator):
     bl_label = "Action Starter"
     bl_idname = "scene.action_starter"
 
     force_reset: bpy.props.BoolProperty(default=False)
 
-    def execute(self, context):
+    def trigger(self, context):
+        mode = context.scene.action_starter_mode
+        if mode == 'NLA':
+            if self.force_reset:
+                clear_triggers()
+            else:
+                schedule_triggers(context.scene.frame_current)
+            return
+
         if not self.force_reset:
             frame = bpy.context.scene.frame_current
         else:
             frame = 5000
-        # OBJECTS
-        for ob in bpy.data.objects:
-            if  ob.pass_index == 10:
-                continue
-            if not ob.animation_data:
-                continue
-            if not ob.animation_data.action:
-                continue
-            for fcurve in ob.animation_data.action.fcurves:
-                for point in fcurve.keyframe_points:
-                    point.co.x = frame
-            
-        # LAMPS
-        for l in bpy.data.lights:
-            if not l.animation_data:
-                continue
-            if not l.animation_data.action:
-                continue
-            for fcurve in l.animation_data.action.fcurves:
-                for point in fcurve.keyframe_points:
-                    point.co.x = frame
-        # SHAPEKEYS
-        shapes = []
-        for me in bpy.data.meshes:
-            shapes.append(me)
-        for me in bpy.data.curves:
-            shapes.append(me)
-        for me in shapes:
-            if not me.shape_keys:
-                continue
-            if not me.shape_keys.animation_data:
-                continue
-            for fcurve in me.shape_keys.animation_data.action.fcurves:
-                for point in fcurve.keyframe_points:
-                    point.co.x = frame
+        retime_actions(collect_actions(), frame, keep_offsets=mode == 'SHIFT')
 
-        # SHADERNODES
-        for ob in bpy.data.objects:
-            if not ob.type == 'MESH':
-                continue
-            if not ob.data.materials:
-                continue
-            for mat in ob.data.materials:
-                if not mat:
-                    continue
-                if not mat.use_nodes:
-                    continue
-                if not mat.node_tree.animation_data:
-                    continue
-                if not mat.node_tree.animation_data.action:
-                    continue
-                for fcurve in mat.node_tree.animation_data.action.fcurves:
-                    for point in fcurve.keyframe_points:
-                        point.co.x = frame
+    def execute(self, context):
+        self.trigger(context)
 
         return {'FINISHED'}
 
@@ -87,6 +207,7 @@ class VIEW_3D_PT_action_starter(Panel):
         row = layout.row()
         col = row.column()
         ob = context.object
+        col.prop(scene, "action_starter_mode")
         col.operator("scene.action_starter").force_reset = False
         col.operator("scene.action_starter", text="Reset").force_reset = True
 
@@ -99,6 +220,21 @@ def register():
     for c in classes:
         bpy.utils.register_class(c)
 
+    bpy.types.Scene.action_starter_mode = bpy.props.EnumProperty(
+            name="Mode",
+            items=(
+                ('COLLAPSE', "Move Keys", "Move every key to the current frame"),
+                ('SHIFT', "Shift Actions", "Shift whole actions so their first key is on the current frame, keeps the timing"),
+                ('NLA', "NLA Strips", "Start the actions at the current frame with NLA strips, the keys are not changed. Reset removes the strips"),
+                ),
+            default='COLLAPSE'
+            )
+
+    bpy.app.handlers.depsgraph_update_post.append(index_update_handler)
+    bpy.app.handlers.undo_post.append(reset_animated_index)
+    bpy.app.handlers.redo_post.append(reset_animated_index)
+    bpy.app.handlers.load_post.append(reset_animated_index)
+
     # keymap
     wm = bpy.context.window_manager
     kc = wm.keyconfigs.addon
@@ -110,7 +246,15 @@ def register():
 
 def unregister():
     for c in classes:
-        bpy.utils.unregister_class()
+        bpy.utils.unregister_class(c)
+
+    bpy.app.handlers.depsgraph_update_post.remove(index_update_handler)
+    bpy.app.handlers.undo_post.remove(reset_animated_index)
+    bpy.app.handlers.redo_post.remove(reset_animated_index)
+    bpy.app.handlers.load_post.remove(reset_animated_index)
+    reset_animated_index()
+
+    del bpy.types.Scene.action_starter_mode
 
 if __name__ == "__main__":
     register()
@@ -0,0 +1,383 @@
+"""
+Render a frame range with several Blender processes at the same time.
+The frames are split into chunks. Every process is pinned to its own GPU(s) or to its own
+share of the CPU cores and takes chunks from its queue. When a queue runs empty the process
+takes chunks from the end of the longest other queue, so faster devices render more frames.
+Run it with the system python, not inside Blender:
+
+$ python3 render_scheduler.py blendfile.blend
+$ python3 render_scheduler.py blendfile.blend --gpu 0 --gpu 1,2 --chunk 10
+$ python3 render_scheduler.py blendfile.blend --cpu 4 --start 1 --end 100
+
+Without --gpu and --cpu all GPUs of --device-type get their own process. If there are none,
+the CPU cores are split across processes, which is often faster than one process for small frames.
+The devices are enabled with enable_gpus.py, which has to be next to this script.
+
+Finished frames are tracked in a manifest next to the .blend file. Frames whose output file
+exists and is a valid image are skipped, so after a crash the same command continues where it
+stopped. Frames that fail are rendered again up to --retries times. Stereo and multiview
+renderings saved as individual images are finished when the files of all views are there.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import shutil
+import threading
+import subprocess
+from collections import deque
+
+
+ENABLE_GPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "enable_gpus.py")
+# must match DEVICES_PREFIX in enable_gpus.py
+DEVICES_PREFIX = "ENABLE_GPUS_DEVICES:"
+SCENE_PREFIX = "RENDER_SCHEDULER_SCENE:"
+# frame range and output paths of every frame, the range given on the command line wins over the scene
+SCENE_QUERY = """
+import bpy, json
+scene = bpy.context.scene
+start, end, step = %r
+start = scene.frame_start if start is None else start
+end = scene.frame_end if end is None else end
+step = scene.frame_step if step is None else step
+# with individual stereo or multiview images every view gets its own file
+render = scene.render
+views = [""]
+if render.use_multiview and render.image_settings.views_format == 'INDIVIDUAL':
+    views = [v.name for v in render.views if v.use]
+print(%r + json.dumps({
+    "range": [start, end, step],
+    "movie": scene.render.is_movie_format,
+    "paths": [[scene.render.frame_path(frame=f, view=v) for v in views] for f in range(start, end + 1, step)],
+}))
+"""
+# header and trailer of image formats, a file cut off by a crash has no trailer
+IMAGE_SIGNATURES = {
+    ".png": ((b"\x89PNG\r\n\x1a\n",), b"IEND\xaeB`\x82"),
+    ".jpg": ((b"\xff\xd8\xff",), b"\xff\xd9"),
+    ".jpeg": ((b"\xff\xd8\xff",), b"\xff\xd9"),
+    ".exr": ((b"v/1\x01",), None),
+    ".tif": ((b"II*\x00", b"MM\x00*"), None),
+    ".tiff": ((b"II*\x00", b"MM\x00*"), None),
+    ".bmp": ((b"BM",), None),
+    ".hdr": ((b"#?",), None),
+    ".webp": ((b"RIFF",), None),
+}
+# pins processes to cores, only available on Linux
+TASKSET = shutil.which("taskset")
+# while one CPU process loads the file or writes its frame the other one keeps the cores busy
+DEFAULT_CPU_WORKERS = 2
+
+
+def run_blender_query(blender, arguments, prefix):
+    """
+    Run a background Blender and return the JSON it printed after prefix.
+    """
+    command = [blender, "-b", "--factory-startup"] + arguments
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    for line in result.stdout.splitlines():
+        if line.startswith(prefix):
+            return json.loads(line[len(prefix):])
+    raise RuntimeError("No answer from Blender:\n" + "\n".join(result.stdout.splitlines()[-5:]))
+
+
+def read_scene(blender, blend_file, start=None, end=None, step=None):
+    query = SCENE_QUERY % ((start, end, step), SCENE_PREFIX)
+    return run_blender_query(blender, [blend_file, "--python-expr", query], SCENE_PREFIX)
+
+
+def list_gpus(blender, device_type):
+    devices = run_blender_query(blender, ["-P", ENABLE_GPUS, "--", "--device-type", device_type, "--list-devices"], DEVICES_PREFIX)
+    return [d for d in devices if d["type"] != "CPU"]
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def split_frames(frames, step, chunk_size):
+    """
+    Split frames into chunks of up to chunk_size frames. A chunk never spans a gap,
+    because Blender renders it as one range.
+    """
+    chunks = []
+    for frame in frames:
+        if chunks and len(chunks[-1]) < chunk_size and frame == chunks[-1][-1] + step:
+            chunks[-1].append(frame)
+        else:
+            chunks.append([frame])
+    return chunks
+
+
+def format_frames(frames):
+    return ", ".join("%d-%d" % (c[0], c[-1]) if len(c) > 1 else str(c[0]) for c in split_frames(frames, 1, len(frames)))
+
+
+def valid_output(path):
+    """
+    Check that a rendered frame exists, is not empty and has the header (and trailer) of its format.
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return False
+    if size == 0:
+        return False
+    signature = IMAGE_SIGNATURES.get(os.path.splitext(path)[1].lower())
+    if signature is None:
+        return True
+    headers, trailer = signature
+    with open(path, "rb") as f:
+        head = f.read(16)
+        if not any(head.startswith(header) for header in headers):
+            return False
+        if trailer:
+            f.seek(max(0, size - len(trailer)))
+            return f.read() == trailer
+    return True
+
+
+def valid_frame(paths):
+    """
+    A frame is finished when the files of all its views are valid.
+    """
+    return all(valid_output(path) for path in paths)
+
+
+def remove_invalid_frame(paths):
+    # otherwise Blender skips the broken files (or their placeholders) when overwriting is disabled
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class RenderManifest:
+    """
+    Status, attempts and render time of every frame, stored as JSON.
+    The output files decide whether a frame is finished, the manifest keeps the history.
+    """
+    def __init__(self, path, blend_file):
+        self.path = path
+        self.frames = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("blend_file") == blend_file:
+                self.frames = data.get("frames", {})
+        self.blend_file = blend_file
+
+    def entry(self, frame):
+        return self.frames.setdefault(str(frame), {"status": "pending", "attempts": 0})
+
+    def mark(self, frame, status, output, worker=None, duration=None):
+        entry = self.entry(frame)
+        entry.update(status=status, output=output)
+        if worker:
+            entry.update(worker=worker, time=duration)
+
+    def save(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"blend_file": self.blend_file, "frames": self.frames}, f, indent=4, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+
+class Worker:
+    """
+    One Blender process at a time on a fixed set of devices.
+    arguments are passed to enable_gpus.py, threads to Blender's -t option.
+    On Linux a CPU worker is also pinned to its cores with taskset.
+    """
+    def __init__(self, name, arguments, threads=0, cores=None):
+        self.name = name
+        self.arguments = arguments
+        self.threads = threads
+        self.cores = cores
+        self.queue = deque()
+        self.frames = 0
+        self.stolen = 0
+        self.render_time = 0.0
+
+
+class RenderScheduler:
+    def __init__(self, blender, blend_file, workers, chunks, step, chunk_size, paths, manifest, retries):
+        self.blender = blender
+        self.blend_file = blend_file
+        self.workers = workers
+        self.step = step
+        self.chunk_size = chunk_size
+        self.paths = paths
+        self.manifest = manifest
+        self.retries = retries
+        self.failed = []
+        self.lock = threading.Lock()
+        # every worker starts with a continuous block of frames
+        per_worker = -(-len(chunks) // len(workers))
+        for i, worker in enumerate(workers):
+            worker.queue.extend(chunks[i * per_worker:(i + 1) * per_worker])
+
+    def next_chunk(self, worker):
+        with self.lock:
+            if worker.queue:
+                return worker.queue.popleft()
+            # steal from the end of the longest queue, farthest away from the frames its owner works on
+            victim = max(self.workers, key=lambda w: len(w.queue))
+            if victim.queue:
+                worker.stolen += 1
+                return victim.queue.pop()
+        return None
+
+    def render_command(self, worker, chunk):
+        command = [self.blender, "-b", self.blend_file]
+        if worker.cores and TASKSET:
+            # not with preexec_fn, which isn't safe while other threads are running
+            command = [TASKSET, "-c", ",".join(str(core) for core in worker.cores)] + command
+        if worker.threads:
+            command += ["-t", str(worker.threads)]
+        command += [
+            "-P", ENABLE_GPUS,
+            "-s", str(chunk[0]), "-e", str(chunk[-1]), "-j", str(self.step), "-a",
+            "--"] + worker.arguments
+        return command
+
+    def render_chunk(self, worker, chunk):
+        start = time.time()
+        result = subprocess.run(
+            self.render_command(worker, chunk), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True)
+        duration = time.time() - start
+        # a crashed process may still have written some frames, a successful one may have missed some
+        rendered = [f for f in chunk if valid_frame(self.paths[f])]
+        missing = [f for f in chunk if f not in rendered]
+        for frame in missing:
+            remove_invalid_frame(self.paths[frame])
+
+        with self.lock:
+            for frame in chunk:
+                self.manifest.entry(frame)["attempts"] += 1
+            for frame in rendered:
+                self.manifest.mark(frame, "done", self.paths[frame], worker.name, duration / len(chunk))
+            worker.frames += len(rendered)
+            worker.render_time += duration
+            if not missing:
+                print("[%s] frames %d-%d done in %.1fs" % (worker.name, chunk[0], chunk[-1], duration))
+            else:
+                print("[%s] frames %s FAILED (exit code %d):\n%s" % (
+                    worker.name, format_frames(missing), result.returncode,
+                    "\n".join(result.stdout.splitlines()[-5:])))
+                retry = [f for f in missing if self.manifest.entry(f)["attempts"] <= self.retries]
+                for frame in missing:
+                    self.manifest.mark(frame, "pending" if frame in retry else "failed", self.paths[frame])
+                self.failed += [f for f in missing if f not in retry]
+                # at the end of the queue, where other workers steal first
+                worker.queue.extend(split_frames(retry, self.step, self.chunk_size))
+            self.manifest.save()
+
+    def work(self, worker):
+        chunk = self.next_chunk(worker)
+        while chunk:
+            self.render_chunk(worker, chunk)
+            chunk = self.next_chunk(worker)
+
+    def run(self):
+        threads = [threading.Thread(target=self.work, args=(w,)) for w in self.workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.failed
+
+
+def build_workers(args, blender):
+    workers = []
+    gpu_specs = args.gpu
+    if not gpu_specs and args.cpu is None:
+        gpu_specs = [str(d["index"]) for d in list_gpus(blender, args.device_type)]
+    for spec in gpu_specs or []:
+        workers.append(Worker("GPU " + spec, ["--device-type", args.device_type, "--devices", spec], args.threads))
+
+    cpu_workers = args.cpu
+    if cpu_workers is None:
+        cpu_workers = 0 if workers else DEFAULT_CPU_WORKERS
+    cores = available_cores()
+    cpu_workers = min(cpu_workers, len(cores))
+    for i in range(cpu_workers):
+        # split the cores evenly, the last worker also gets the remainder
+        share = len(cores) // cpu_workers
+        part = cores[i * share:] if i == cpu_workers - 1 else cores[i * share:(i + 1) * share]
+        workers.append(Worker("CPU %d" % i, ["--cpu-only"], len(part), part))
+    return workers
+
+
+def print_summary(workers):
+    for worker in workers:
+        per_frame = worker.render_time / worker.frames if worker.frames else 0.0
+        print("%s: %d frames, %.1fs per frame, %d chunks stolen" % (worker.name, worker.frames, per_frame, worker.stolen))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description="Render a frame range with several Blender processes")
+    parser.add_argument("blend_file")
+    parser.add_argument("--blender", default="blender", help="path to the Blender executable")
+    parser.add_argument("--start", type=int, help="first frame, default: from the scene")
+    parser.add_argument("--end", type=int, help="last frame, default: from the scene")
+    parser.add_argument("--step", type=int, help="frame step, default: from the scene")
+    parser.add_argument("--chunk", type=int, default=5, help="frames per Blender process")
+    parser.add_argument("--device-type", default="OPTIX", help="OPTIX, CUDA, HIP, ONEAPI or METAL")
+    parser.add_argument("--gpu", action="append", help="GPU indices of one process, e.g. 0 or 1,2. Can be repeated")
+    parser.add_argument("--cpu", type=int, help="number of CPU processes sharing the cores")
+    parser.add_argument("--threads", type=int, default=0, help="threads of every GPU process")
+    parser.add_argument("--retries", type=int, default=2, help="how often a failed frame is rendered again")
+    parser.add_argument("--manifest", help="frame status file, default: next to the .blend file")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_arguments(argv)
+    blend_file = os.path.abspath(args.blend_file)
+    scene = read_scene(args.blender, blend_file, args.start, args.end, args.step)
+    if scene["movie"]:
+        print("Resuming needs an image sequence, the output of the scene is a movie file")
+        return 1
+    start, end, step = scene["range"]
+    frames = list(range(start, end + 1, step))
+    paths = dict(zip(frames, scene["paths"]))
+
+    manifest = RenderManifest(args.manifest or os.path.splitext(blend_file)[0] + ".render_manifest.json", blend_file)
+    pending = []
+    for frame in frames:
+        if valid_frame(paths[frame]):
+            manifest.mark(frame, "done", paths[frame])
+        else:
+            remove_invalid_frame(paths[frame])
+            manifest.mark(frame, "pending", paths[frame])
+            # every run gets all its retries
+            manifest.entry(frame)["attempts"] = 0
+            pending.append(frame)
+    manifest.save()
+    print("%d of %d frames already rendered" % (len(frames) - len(pending), len(frames)))
+    if not pending:
+        return 0
+
+    workers = build_workers(args, args.blender)
+    if not workers:
+        print("No devices to render with")
+        return 1
+    chunk_size = max(1, args.chunk)
+    chunks = split_frames(pending, step, chunk_size)
+    print("Rendering frames %s in %d chunks with %s" % (format_frames(pending), len(chunks), ", ".join(w.name for w in workers)))
+
+    scheduler = RenderScheduler(
+        args.blender, blend_file, workers, chunks, step, chunk_size, paths, manifest, max(0, args.retries))
+    failed = scheduler.run()
+    print_summary(workers)
+    if failed:
+        print("Failed frames: " + format_frames(sorted(failed)))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
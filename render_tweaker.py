@@ -30,7 +30,16 @@ bl_info = {
 
 
 import bpy
-from bpy.props import StringProperty, BoolProperty, IntProperty
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from bpy.props import StringProperty, BoolProperty, IntProperty, FloatProperty, EnumProperty
 from bpy.utils import register_class, unregister_class
 from bl_operators.presets import AddPresetBase
 
@@ -93,11 +102,106 @@ def return_proplist():
     return proplist
 
 
+def return_render_proplist():
+    proplist = [
+    "border_max_x",
+    "border_max_y",
+    "border_min_x",
+    "border_min_y",
+    "motion_blur_shutter",
+    "resolution_percentage",
+    "resolution_x",
+    "resolution_y",
+    "threads",
+    "threads_mode",
+    "tile_x",
+    "tile_y",
+    "use_border",
+    "use_crop_to_border",
+    "use_motion_blur",
+    "use_persistent_data",
+    "use_simplify"
+    ]
+    return proplist
+
+
+# the settings groups of a snapshot and where they live in the scene
+def snapshot_groups(scene):
+    return (
+        ("cycles", scene.cycles, return_proplist()),
+        ("render", scene.render, return_render_proplist())
+        )
+
+
+# capture the render settings in a dict per settings group, or only the given groups.
+# properties that don't exist in this Blender version are skipped
+def capture_snapshot(scene, groups=None):
+    snapshot = {}
+    for group, owner, proplist in snapshot_groups(scene):
+        if groups is not None and group not in groups:
+            continue
+        snapshot[group] = {prop: getattr(owner, prop) for prop in proplist if hasattr(owner, prop)}
+    return snapshot
+
+
+# stored slots of older versions only contain the cycles settings
+def read_snapshot(stored):
+    if hasattr(stored, "to_dict"):
+        stored = stored.to_dict()
+    if "cycles" not in stored:
+        stored = {"cycles": stored}
+    return stored
+
+
+def values_differ(current, stored):
+    if isinstance(current, float) and isinstance(stored, (float, int)):
+        return not math.isclose(current, stored, rel_tol=1e-6, abs_tol=1e-9)
+    return current != stored
+
+
+# list the settings of the scene that differ from the snapshot as (group, prop, current, stored)
+def diff_snapshot(scene, snapshot, groups=None):
+    diff = []
+    for group, owner, proplist in snapshot_groups(scene):
+        if groups is not None and group not in groups:
+            continue
+        for prop, stored in snapshot.get(group, {}).items():
+            if not hasattr(owner, prop):
+                continue
+            current = getattr(owner, prop)
+            if values_differ(current, stored):
+                diff.append((group, prop, current, stored))
+    return diff
+
+
+# only write the settings that differ, every write can restart the viewport render
+def apply_snapshot(scene, snapshot, groups=None):
+    owners = {group: owner for group, owner, proplist in snapshot_groups(scene)}
+    diff = diff_snapshot(scene, snapshot, groups)
+    for group, prop, current, stored in diff:
+        setattr(owners[group], prop, stored)
+    return diff
+
+
+# the master scene is looked up once and then remembered
+master_scene_name = ""
+
+def get_master_scene():
+    global master_scene_name
+    master = bpy.data.scenes.get(master_scene_name)
+    if master and master.master_scene:
+        return master
+    for s in bpy.data.scenes:
+        if s.master_scene:
+            master_scene_name = s.name
+            return s
+    return None
+
+
 # save all visibly relevant cycles scene settings
-def save_settings_to_storage(slot_id):
+def save_settings_to_storage(slot_id, stats=None):
     context = bpy.context
     scene = context.scene
-    proplist = return_proplist()
 
     # if the dict doesnt exist yet, create it.
     if not scene.get('renderslot_properties'):
@@ -109,44 +213,318 @@ def save_settings_to_storage(slot_id):
     else:
         slot_id = str(get_slot_id())
         bpy.context.window_manager.recent_render = str(int(slot_id)+1)
-    # create the dict for the slot
-    slot_id_dict = {}
-    # fill the dict with the properties
-    for prop in proplist:
-        slot_id_dict[prop] = getattr(context.scene.cycles, prop)
-    # assign the prop dict to the slot id as value
-    renderslot_properties[slot_id] = slot_id_dict
+    # assign the snapshot of the settings to the slot id as value
+    snapshot = capture_snapshot(scene)
+    if stats:
+        snapshot["stats"] = stats
+    renderslot_properties[slot_id] = snapshot
 
 
 # load cycles render settings
 def load_settings_from_storage(context, slot_id):
     scene = context.scene
     try:
-        for s in bpy.data.scenes:
-            if s.master_scene:
-                master = s
+        master = get_master_scene()
         renderslot_properties = master.get('renderslot_properties')
         # find the active slot id
         if not slot_id == 8:
             slot_id = str(get_slot_id())
         else:
             slot_id = str(slot_id)
-        # get the dict for that id
-        prop_dict = renderslot_properties[slot_id]
-        # read out the properties from the script and set them
-        for prop in prop_dict:
-            new_value = prop_dict[prop]
-            setattr(scene.cycles, prop, new_value)
+        # get the snapshot for that id and only write what differs
+        apply_snapshot(scene, read_snapshot(renderslot_properties[slot_id]))
         return True
     except:
         return False
 
 
 
-# if slot recording is enabled, save render settings from current slot
+# start time of the running render
+render_start = 0.0
+
+
+def render_pre_handler(scene, *args):
+    global render_start
+    render_start = time.time()
+
+
+# collect time, resolution and device of the render that just finished.
+# peak memory isn't available to Python in renders started from the interface
+def collect_render_stats(scene):
+    render = scene.render
+    percentage = render.resolution_percentage / 100
+    stats = {
+        "time": time.time() - render_start if render_start else 0.0,
+        "resolution": "%dx%d" % (render.resolution_x * percentage, render.resolution_y * percentage),
+        "device": scene.cycles.device if cycles_exists() else render.engine,
+        "samples": scene.cycles.samples if cycles_exists() else 0
+        }
+    return stats
+
+
+def format_render_stats(stats):
+    return "%.1fs, %s, %s %d samples" % (stats.get("time", 0.0), stats.get("resolution", ""), stats.get("device", ""), stats.get("samples", 0))
+
+
+# if slot recording is enabled, save render settings and stats from current slot
 def slot_handler(scene):
     if scene.record_settings:
-        save_settings_to_storage(0)
+        save_settings_to_storage(0, collect_render_stats(scene))
+
+
+
+# parse a comma separated list of numbers like "16, 32, 64"
+def parse_sweep_values(text):
+    values = []
+    for v in text.split(","):
+        v = v.strip()
+        if v:
+            values.append(int(v))
+    return values
+
+
+# render the scene and read the result back.
+# the render result can't be read directly, so it is saved to a temporary EXR
+def render_result_pixels(scene):
+    path = os.path.join(bpy.app.tempdir, "render_tweaker_measure.exr")
+    settings = scene.render.image_settings
+    stored = settings.file_format, settings.color_mode
+    try:
+        settings.file_format = 'OPEN_EXR'
+        settings.color_mode = 'RGB'
+        bpy.data.images['Render Result'].save_render(path, scene)
+    finally:
+        settings.file_format, settings.color_mode = stored
+    img = bpy.data.images.load(path)
+    try:
+        pixels = np.array(img.pixels[:], dtype=np.float32)
+        x, y = img.size
+        pixels = pixels.reshape(y, x, img.channels)
+    finally:
+        bpy.data.images.remove(img)
+    os.remove(path)
+    return pixels
+
+
+# estimate the noise as the difference of every pixel to the mean of its 4 neighbours,
+# relative to the brightness of the image. Lower is less noisy.
+def estimate_noise(pixels):
+    luminance = pixels[..., :3] @ np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+    if min(luminance.shape) < 3:
+        return 0.0
+    center = luminance[1:-1, 1:-1]
+    neighbours = (luminance[:-2, 1:-1] + luminance[2:, 1:-1] + luminance[1:-1, :-2] + luminance[1:-1, 2:]) / 4.0
+    residual = center - neighbours
+    return float(np.sqrt(np.mean(residual**2)) / max(float(np.mean(center)), 1e-6))
+
+
+# render the current settings and return the render time in seconds and the noise estimate
+def measure_render(scene):
+    start = time.time()
+    bpy.ops.render.render()
+    seconds = time.time() - start
+    return seconds, estimate_noise(render_result_pixels(scene))
+
+
+# render only a region: the border if one is set, otherwise the center of the image
+def setup_measure_region(scene, crop):
+    render = scene.render
+    render.use_crop_to_border = True
+    if render.use_border:
+        return
+    render.use_border = True
+    render.border_min_x = render.border_min_y = 0.5 - crop / 2
+    render.border_max_x = render.border_max_y = 0.5 + crop / 2
+
+
+# runs within the noise tolerance of the least noisy run count as equal quality
+def sweep_results(scene):
+    results = [dict(r) for r in scene.get('render_tweaker_sweep', [])]
+    if not results:
+        return []
+    best = min(r["noise"] for r in results)
+    for r in results:
+        r["acceptable"] = r["noise"] <= best * (1 + scene.sweep_noise_tolerance)
+    return sorted(results, key=lambda r: r["time"])
+
+
+
+# render with one cycles setting changed and return the noise estimate
+def noise_at(scene, prop, value):
+    setattr(scene.cycles, prop, value)
+    seconds, noise = measure_render(scene)
+    print("Render Tweaker search: %s = %s: %.2fs, noise %.4f" % (prop, value, seconds, noise))
+    return noise
+
+
+# find the lowest sample count between low and high that stays below the noise target.
+# returns None if even the high sample count is too noisy
+def bisect_samples(scene, low, high, target):
+    if noise_at(scene, "samples", high) > target:
+        return None
+    if noise_at(scene, "samples", low) <= target:
+        return low
+    # a few percent more or less samples don't make a visible difference
+    while high - low > max(1, low // 20):
+        mid = (low + high) // 2
+        if noise_at(scene, "samples", mid) <= target:
+            high = mid
+        else:
+            low = mid
+    scene.cycles.samples = high
+    return high
+
+
+# raise the light sampling threshold as far as the noise target allows
+def bisect_light_threshold(scene, target, steps=5):
+    low, high = scene.cycles.light_sampling_threshold, 1.0
+    for i in range(steps):
+        mid = (low + high) / 2
+        if noise_at(scene, "light_sampling_threshold", mid) <= target:
+            low = mid
+        else:
+            high = mid
+    scene.cycles.light_sampling_threshold = low
+    return low
+
+
+# write cycles settings the same way the preset operator does, so the preset menu can load them
+def write_tweaker_preset(name, cycles_settings):
+    preset_dir = bpy.utils.user_resource('SCRIPTS', os.path.join("presets", "render_tweaker_presets"), autocreate=True)
+    filepath = os.path.join(preset_dir, bpy.path.clean_name(name) + ".py")
+    f = open(filepath, "w")
+    f.write("import bpy\n")
+    f.write("render = bpy.context.scene.render\n")
+    f.write("cycles = bpy.context.scene.cycles\n\n")
+    for prop in sorted(cycles_settings):
+        f.write("cycles.%s = %r\n" % (prop, cycles_settings[prop]))
+    f.close()
+    return filepath
+
+
+
+LIBRARY_VERSION = 1
+
+# library settings are rolled out to many shots, so they only carry the sampling
+# settings. resolution, border, threads and tiles stay per shot
+LIBRARY_GROUPS = ("cycles",)
+
+# loaded libraries by path, with the modification time they were read at
+library_cache = {}
+
+
+# read a settings library, it is only parsed again when the file changed
+def load_library(path):
+    if not os.path.exists(path):
+        return {"version": LIBRARY_VERSION, "snapshots": {}}
+    mtime = os.path.getmtime(path)
+    cached = library_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path) as f:
+        library = json.load(f)
+    if library.get("version", 0) > LIBRARY_VERSION:
+        raise ValueError("%s was written by a newer Render Tweaker" % path)
+    library_cache[path] = (mtime, library)
+    return library
+
+
+def save_library(path, library):
+    library["version"] = LIBRARY_VERSION
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(library, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+    library_cache[path] = (os.path.getmtime(path), library)
+
+
+# add the render settings of the scene to the library, an existing snapshot gets a new revision
+def store_in_library(path, name, scene):
+    library = load_library(path)
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    previous = library["snapshots"].get(name, {})
+    snapshot = capture_snapshot(scene, LIBRARY_GROUPS)
+    snapshot.update({
+        "revision": previous.get("revision", 0) + 1,
+        "created": previous.get("created", now),
+        "modified": now,
+        "blender": bpy.app.version_string,
+        "source": os.path.basename(bpy.data.filepath),
+        "scene": scene.name
+        })
+    library["snapshots"][name] = snapshot
+    save_library(path, library)
+    return snapshot
+
+
+def library_path(scene):
+    return bpy.path.abspath(scene.tweaker_library_path)
+
+
+# the enum items have to be kept alive while Blender shows them
+library_items = []
+
+def library_snapshot_items(self, context):
+    library_items.clear()
+    try:
+        snapshots = load_library(library_path(context.scene))["snapshots"]
+    except (OSError, ValueError):
+        snapshots = {}
+    for name in sorted(snapshots):
+        snapshot = snapshots[name]
+        library_items.append((name, name, "Revision %d, %s" % (snapshot.get("revision", 1), snapshot.get("modified", ""))))
+    return library_items
+
+
+# apply the snapshot to the scene or all scenes, returns the changed (scene, group, prop, old, new)
+def apply_to_scenes(snapshot, scenes, groups=LIBRARY_GROUPS):
+    changes = []
+    for scene in scenes:
+        for group, prop, current, stored in apply_snapshot(scene, snapshot, groups):
+            changes.append((scene.name, group, prop, current, stored))
+    return changes
+
+
+
+# child processes print their changes on a line starting with this, so the driver can collect them
+SUMMARY_PREFIX = "RENDER_TWEAKER_SUMMARY "
+
+
+# apply settings to one .blend file in a background Blender and return its summary
+def apply_to_file(blend_file, arguments):
+    command = [
+        bpy.app.binary_path, "-b", "--factory-startup", blend_file,
+        "--python-exit-code", "1", "-P", os.path.abspath(__file__), "--"
+        ] + arguments
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    summary = {"file": blend_file, "changes": [], "error": ""}
+    for line in result.stdout.splitlines():
+        if line.startswith(SUMMARY_PREFIX):
+            summary.update(json.loads(line[len(SUMMARY_PREFIX):]))
+    if result.returncode != 0:
+        summary["error"] = "\n".join(result.stdout.splitlines()[-5:])
+    return summary
+
+
+# apply settings to many .blend files, every file in its own Blender process, jobs of them at a time
+def batch_apply(blend_files, arguments, jobs):
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        return list(pool.map(lambda f: apply_to_file(f, arguments), blend_files))
+
+
+def list_blend_files(folder):
+    return [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.endswith(".blend")]
+
+
+def print_batch_summary(summaries):
+    for summary in summaries:
+        name = os.path.basename(summary["file"])
+        if summary["error"]:
+            print("%s: FAILED\n%s" % (name, summary["error"]))
+            continue
+        print("%s: %d changes" % (name, len(summary["changes"])))
+        for change in summary["changes"]:
+            print("    %s: %s.%s %r -> %r" % tuple(change))
 
 
 
@@ -219,6 +597,208 @@ class RENDER_TWEAKER_OT_render_slot_restore(bpy.types.Operator):
 
 
 
+class RENDER_TWEAKER_OT_sampling_sweep(bpy.types.Operator):
+    '''Render a region with every combination of the sweep samples and bounces and measure time and noise'''
+    bl_idname = "scene.render_tweaker_sweep"
+    bl_label = "Run Sampling Sweep"
+
+    @classmethod
+    def poll(cls, context):
+        return cycles_exists()
+
+    def execute(self, context):
+        scene = context.scene
+        try:
+            samples = parse_sweep_values(scene.sweep_samples)
+            bounces = parse_sweep_values(scene.sweep_bounces)
+        except ValueError:
+            self.report({'ERROR'}, "Samples and bounces need to be comma separated numbers")
+            return {'CANCELLED'}
+        if not samples or not bounces:
+            self.report({'ERROR'}, "Please enter the samples and bounces to sweep")
+            return {'CANCELLED'}
+
+        snapshot = capture_snapshot(scene)
+        # the test renders shouldn't overwrite the recorded render slot
+        record_settings = scene.record_settings
+        scene.record_settings = False
+        results = []
+        try:
+            setup_measure_region(scene, scene.sweep_crop)
+            for b in bounces:
+                for s in samples:
+                    scene.cycles.samples = s
+                    scene.cycles.max_bounces = b
+                    seconds, noise = measure_render(scene)
+                    results.append({"samples": s, "max_bounces": b, "time": seconds, "noise": noise})
+                    print("Render Tweaker sweep: %d samples, %d bounces: %.2fs, noise %.4f" % (s, b, seconds, noise))
+        finally:
+            apply_snapshot(scene, snapshot)
+            scene.record_settings = record_settings
+        scene['render_tweaker_sweep'] = results
+        return {'FINISHED'}
+
+
+
+class RENDER_TWEAKER_OT_apply_sweep_result(bpy.types.Operator):
+    '''Use the samples and bounces of this sweep result'''
+    bl_idname = "scene.render_tweaker_apply_sweep"
+    bl_label = "Apply Sweep Result"
+
+    samples = IntProperty()
+    max_bounces = IntProperty()
+
+    def execute(self, context):
+        context.scene.cycles.samples = self.samples
+        context.scene.cycles.max_bounces = self.max_bounces
+        return {'FINISHED'}
+
+
+
+class RENDER_TWEAKER_OT_noise_target_search(bpy.types.Operator):
+    '''Find the lowest sample count that reaches the noise target and save it as preset'''
+    bl_idname = "scene.render_tweaker_noise_search"
+    bl_label = "Find Samples for Noise Target"
+
+    @classmethod
+    def poll(cls, context):
+        return cycles_exists()
+
+    def execute(self, context):
+        scene = context.scene
+        target = scene.noise_target
+        low = min(scene.search_min_samples, scene.search_max_samples)
+        high = max(scene.search_min_samples, scene.search_max_samples)
+
+        snapshot = capture_snapshot(scene)
+        record_settings = scene.record_settings
+        scene.record_settings = False
+        try:
+            setup_measure_region(scene, scene.sweep_crop)
+            samples = bisect_samples(scene, low, high, target)
+            if samples is not None and scene.search_light_threshold and hasattr(scene.cycles, "light_sampling_threshold"):
+                bisect_light_threshold(scene, target)
+            result = capture_snapshot(scene)["cycles"]
+        finally:
+            apply_snapshot(scene, snapshot)
+            scene.record_settings = record_settings
+
+        if samples is None:
+            self.report({'ERROR'}, "Even %d samples don't reach the noise target" % high)
+            return {'CANCELLED'}
+        try:
+            write_tweaker_preset(scene.search_preset_name, result)
+        except OSError as e:
+            self.report({'ERROR'}, "%d samples reach the noise target, but the preset could not be saved: %s" % (samples, e))
+            return {'CANCELLED'}
+        self.report({'INFO'}, "%d samples reach the noise target, saved as preset %s" % (samples, scene.search_preset_name))
+        return {'FINISHED'}
+
+
+
+class RENDER_TWEAKER_OT_library_store(bpy.types.Operator):
+    '''Store the current render settings in the settings library'''
+    bl_idname = "scene.render_tweaker_library_store"
+    bl_label = "Store in Library"
+
+    @classmethod
+    def poll(cls, context):
+        return cycles_exists() and context.scene.tweaker_snapshot_name
+
+    def execute(self, context):
+        scene = context.scene
+        try:
+            snapshot = store_in_library(library_path(scene), scene.tweaker_snapshot_name, scene)
+        except (OSError, ValueError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        self.report({'INFO'}, "Stored %s, revision %d" % (scene.tweaker_snapshot_name, snapshot["revision"]))
+        return {'FINISHED'}
+
+
+
+class RENDER_TWEAKER_OT_library_apply(bpy.types.Operator):
+    '''Apply the library settings to this scene or all scenes, only changed settings are written'''
+    bl_idname = "scene.render_tweaker_library_apply"
+    bl_label = "Apply from Library"
+
+    all_scenes = BoolProperty(default=False)
+
+    @classmethod
+    def poll(cls, context):
+        return cycles_exists() and context.scene.tweaker_library_snapshot
+
+    def execute(self, context):
+        scene = context.scene
+        try:
+            snapshot = load_library(library_path(scene))["snapshots"][scene.tweaker_library_snapshot]
+        except (OSError, ValueError, KeyError) as e:
+            self.report({'ERROR'}, "Could not load the snapshot: %s" % e)
+            return {'CANCELLED'}
+        scenes = bpy.data.scenes if self.all_scenes else [scene]
+        changes = apply_to_scenes(snapshot, scenes)
+        self.report({'INFO'}, "Changed %d settings" % len(changes))
+        return {'FINISHED'}
+
+
+
+class RENDER_TWEAKER_OT_library_apply_folder(bpy.types.Operator):
+    '''Apply the library settings to all scenes of all .blend files in the folder and save them'''
+    bl_idname = "scene.render_tweaker_library_apply_folder"
+    bl_label = "Apply to Folder"
+
+    @classmethod
+    def poll(cls, context):
+        return context.scene.tweaker_library_snapshot and context.scene.tweaker_batch_folder
+
+    def execute(self, context):
+        scene = context.scene
+        folder = bpy.path.abspath(scene.tweaker_batch_folder)
+        # the open file would be overwritten when it is saved the next time
+        blend_files = [f for f in list_blend_files(folder)
+            if os.path.abspath(f) != os.path.abspath(bpy.data.filepath)]
+        arguments = [
+            "--library", library_path(scene),
+            "--snapshot", scene.tweaker_library_snapshot,
+            "--all-scenes"
+            ]
+        summaries = batch_apply(blend_files, arguments, scene.tweaker_batch_jobs)
+        print_batch_summary(summaries)
+        failed = [os.path.basename(s["file"]) for s in summaries if s["error"]]
+        if failed:
+            self.report({'ERROR'}, "Could not apply the settings to %s" % ", ".join(failed))
+        else:
+            changes = sum(len(s["changes"]) for s in summaries)
+            self.report({'INFO'}, "Applied %s to %d files, %d settings changed" % (scene.tweaker_library_snapshot, len(blend_files), changes))
+        return {'FINISHED'}
+
+
+
+class RENDER_TWEAKER_OT_export_snapshot(bpy.types.Operator):
+    '''Export the current render settings as snapshot file for command line use'''
+    bl_idname = "scene.render_tweaker_export_snapshot"
+    bl_label = "Export Snapshot"
+
+    filepath = StringProperty(subtype='FILE_PATH')
+    filter_glob = StringProperty(default="*.json", options={'HIDDEN'})
+
+    @classmethod
+    def poll(cls, context):
+        return cycles_exists()
+
+    def invoke(self, context, event):
+        if not self.filepath:
+            self.filepath = "render_settings.json"
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        with open(bpy.path.ensure_ext(self.filepath, ".json"), "w") as f:
+            json.dump(capture_snapshot(context.scene), f, indent=1, sort_keys=True)
+        return {'FINISHED'}
+
+
+
 class RENDER_TWEAKER_OT_tweaker_preset_add(AddPresetBase, bpy.types.Operator):
     ''' Add a new render preset'''
     bl_idname = "render.tweaker_preset_add"
@@ -273,10 +853,76 @@ class RENDER_TWEAKER_PT_main_ui(bpy.types.Panel):
 
         
 
+        # render stats of the recorded slots
+        renderslot_properties = scene.get('renderslot_properties')
+        if renderslot_properties:
+            col = layout.column(align=True)
+            for slot_id in sorted(renderslot_properties.keys()):
+                if slot_id == "8":
+                    continue
+                stats = read_snapshot(renderslot_properties[slot_id]).get("stats")
+                if stats:
+                    col.label(text="Slot %d: %s" % (int(slot_id)+1, format_render_stats(stats)))
+
         row = layout.row(align=True)
         row.operator("scene.save_main_rendersettings", text="Quick Save Settings")
         row.operator("scene.restore_main_rendersettings", text="Quick Restore Settings")
 
+        box = layout.box()
+        box.label(text="Settings Library")
+        col = box.column(align=True)
+        col.prop(scene, "tweaker_library_path")
+        row = col.row(align=True)
+        row.prop(scene, "tweaker_snapshot_name", text="")
+        row.operator("scene.render_tweaker_library_store", icon="FILE_TICK")
+        col = box.column(align=True)
+        col.prop(scene, "tweaker_library_snapshot", text="")
+        row = col.row(align=True)
+        row.operator("scene.render_tweaker_library_apply", text="Apply to Scene").all_scenes = False
+        row.operator("scene.render_tweaker_library_apply", text="Apply to All Scenes").all_scenes = True
+        row = col.row(align=True)
+        row.prop(scene, "tweaker_batch_folder", text="")
+        row.prop(scene, "tweaker_batch_jobs", text="Jobs")
+        col.operator("scene.render_tweaker_library_apply_folder")
+        col.operator("scene.render_tweaker_export_snapshot", icon="EXPORT")
+
+        box = layout.box()
+        box.label(text="Sampling Sweep")
+        col = box.column(align=True)
+        col.prop(scene, "sweep_samples")
+        col.prop(scene, "sweep_bounces")
+        row = col.row(align=True)
+        row.prop(scene, "sweep_crop")
+        row.prop(scene, "sweep_noise_tolerance")
+        col.operator("scene.render_tweaker_sweep", icon="TIME")
+        results = sweep_results(scene)
+        if results:
+            col = box.column(align=True)
+            row = col.row()
+            for title in ("Samples", "Bounces", "Time", "Noise", ""):
+                row.label(text=title)
+            for r in results:
+                row = col.row()
+                row.active = r["acceptable"]
+                row.label(text=str(r["samples"]))
+                row.label(text=str(r["max_bounces"]))
+                row.label(text="%.2fs" % r["time"])
+                row.label(text="%.4f" % r["noise"])
+                props = row.operator("scene.render_tweaker_apply_sweep", text="Use", icon="FILE_TICK" if r["acceptable"] else "NONE")
+                props.samples = r["samples"]
+                props.max_bounces = r["max_bounces"]
+
+        box = layout.box()
+        box.label(text="Noise Target Search")
+        col = box.column(align=True)
+        col.prop(scene, "noise_target")
+        row = col.row(align=True)
+        row.prop(scene, "search_min_samples")
+        row.prop(scene, "search_max_samples")
+        col.prop(scene, "search_light_threshold")
+        col.prop(scene, "search_preset_name")
+        col.operator("scene.render_tweaker_noise_search", icon="VIEWZOOM")
+
 
 
 class RENDER_TWEAKER_MT_tweaker_presets(bpy.types.Menu):
@@ -298,6 +944,13 @@ classes = (
     RENDER_TWEAKER_OT_render_slot_restore,
     RENDER_TWEAKER_OT_save_main_rendersettings,
     RENDER_TWEAKER_OT_restore_main_rendersettings,
+    RENDER_TWEAKER_OT_sampling_sweep,
+    RENDER_TWEAKER_OT_apply_sweep_result,
+    RENDER_TWEAKER_OT_noise_target_search,
+    RENDER_TWEAKER_OT_library_store,
+    RENDER_TWEAKER_OT_library_apply,
+    RENDER_TWEAKER_OT_library_apply_folder,
+    RENDER_TWEAKER_OT_export_snapshot,
     RENDER_TWEAKER_OT_tweaker_preset_add,
     RENDER_TWEAKER_MT_tweaker_presets,
     RENDER_TWEAKER_PT_main_ui
@@ -307,6 +960,7 @@ def register():
     for c in classes:
         register_class(c)
 
+    bpy.app.handlers.render_pre.append(render_pre_handler)
     bpy.app.handlers.render_complete.append(slot_handler)
 
     bpy.types.Scene.record_settings = BoolProperty(
@@ -317,6 +971,86 @@ def register():
         name = "Master Scene",
         description="When working with multiple scenes, make this the master scene to copy settings from",
         default=False)
+    bpy.types.Scene.sweep_samples = StringProperty(
+        name = "Samples",
+        description = "Comma separated sample counts to render in the sweep",
+        default = "16, 32, 64, 128, 256"
+        )
+    bpy.types.Scene.sweep_bounces = StringProperty(
+        name = "Max Bounces",
+        description = "Comma separated maximum bounces to render in the sweep",
+        default = "4, 8, 12"
+        )
+    bpy.types.Scene.sweep_crop = FloatProperty(
+        name = "Region Size",
+        description = "Size of the rendered region in the center of the image if no render border is set",
+        default = 0.25,
+        min = 0.05,
+        max = 1.0,
+        subtype = 'FACTOR'
+        )
+    bpy.types.Scene.sweep_noise_tolerance = FloatProperty(
+        name = "Noise Tolerance",
+        description = "Results with up to this much more noise than the best one count as equal quality",
+        default = 0.1,
+        min = 0.0,
+        subtype = 'FACTOR'
+        )
+    bpy.types.Scene.noise_target = FloatProperty(
+        name = "Noise Target",
+        description = "Highest acceptable noise estimate, as shown in the sampling sweep",
+        default = 0.02,
+        min = 0.0,
+        precision = 4
+        )
+    bpy.types.Scene.search_min_samples = IntProperty(
+        name = "Min Samples",
+        default = 16,
+        min = 1
+        )
+    bpy.types.Scene.search_max_samples = IntProperty(
+        name = "Max Samples",
+        default = 1024,
+        min = 1
+        )
+    bpy.types.Scene.search_light_threshold = BoolProperty(
+        name = "Raise Light Threshold",
+        description = "Also raise the light sampling threshold as far as the noise target allows",
+        default = False
+        )
+    bpy.types.Scene.search_preset_name = StringProperty(
+        name = "Preset Name",
+        description = "Name of the preset the result is saved as",
+        default = "Noise Target"
+        )
+    bpy.types.Scene.tweaker_library_path = StringProperty(
+        name = "Library",
+        description = "JSON file with the render settings of the project",
+        default = "//render_tweaker_library.json",
+        subtype = 'FILE_PATH'
+        )
+    bpy.types.Scene.tweaker_snapshot_name = StringProperty(
+        name = "Snapshot Name",
+        description = "Name the current settings are stored as in the library",
+        default = ""
+        )
+    bpy.types.Scene.tweaker_library_snapshot = EnumProperty(
+        name = "Library Snapshot",
+        description = "Render settings from the library",
+        items = library_snapshot_items
+        )
+    bpy.types.Scene.tweaker_batch_folder = StringProperty(
+        name = "Folder",
+        description = "Folder with .blend files to apply the library settings to",
+        subtype = 'DIR_PATH'
+        )
+    bpy.types.Scene.tweaker_batch_jobs = IntProperty(
+        name = "Parallel Jobs",
+        description = "How many files are processed at the same time",
+        default = 4,
+        min = 1,
+        max = 64
+        )
     bpy.types.WindowManager.recent_render = StringProperty(
         name = "Recently Rendered Slot",
         description = "Shows the most recently rendered slot",
@@ -336,7 +1070,67 @@ def unregister():
 
     if slot_handler in bpy.app.handlers.render_complete:
         bpy.app.handlers.render_complete.remove(slot_handler)
+    if render_pre_handler in bpy.app.handlers.render_pre:
+        bpy.app.handlers.render_pre.remove(render_pre_handler)
+
+
+# command line entry, to apply settings without opening files by hand:
+# blender -b file.blend -P render_tweaker.py -- --apply snapshot.json
+# blender -b file.blend -P render_tweaker.py -- --library lib.json --snapshot name
+# and to apply them to all .blend files of a folder, several files at a time:
+# blender -b -P render_tweaker.py -- --batch folder --apply snapshot.json --jobs 8
+# only the cycles settings are applied, add --groups cycles,render for resolution, border and threads too
+def main(argv):
+    parser = argparse.ArgumentParser(prog="render_tweaker.py", description="Apply Render Tweaker settings")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--apply", help="snapshot JSON file, as written by Export Snapshot")
+    source.add_argument("--library", help="settings library JSON file")
+    parser.add_argument("--snapshot", help="name of the snapshot in the library")
+    parser.add_argument("--all-scenes", action="store_true", help="apply to all scenes instead of the active one")
+    parser.add_argument("--dry-run", action="store_true", help="only report the changes, don't save")
+    parser.add_argument("--batch", help="apply to all .blend files in this folder")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="files processed at the same time in batch mode")
+    parser.add_argument("--groups", default=",".join(LIBRARY_GROUPS), help="comma separated settings groups to apply, cycles and/or render")
+    args = parser.parse_args(argv)
+    if args.library and not args.snapshot:
+        parser.error("--library needs --snapshot")
+    groups = tuple(g.strip() for g in args.groups.split(",") if g.strip())
+    known = [g[0] for g in snapshot_groups(bpy.context.scene)]
+    unknown = [g for g in groups if g not in known]
+    if unknown or not groups:
+        parser.error("--groups must be one or more of %s" % ", ".join(known))
+
+    if args.batch:
+        # every file gets the same arguments, without the batch options
+        if args.apply:
+            arguments = ["--apply", os.path.abspath(args.apply)]
+        else:
+            arguments = ["--library", os.path.abspath(args.library), "--snapshot", args.snapshot]
+        if args.all_scenes:
+            arguments.append("--all-scenes")
+        if args.dry_run:
+            arguments.append("--dry-run")
+        arguments += ["--groups", ",".join(groups)]
+        summaries = batch_apply(list_blend_files(args.batch), arguments, args.jobs)
+        print_batch_summary(summaries)
+        if any(s["error"] for s in summaries):
+            sys.exit(1)
+        return
+
+    if args.apply:
+        with open(args.apply) as f:
+            snapshot = json.load(f)
+    else:
+        snapshot = load_library(args.library)["snapshots"][args.snapshot]
+    scenes = bpy.data.scenes if args.all_scenes else [bpy.context.scene]
+    changes = apply_to_scenes(snapshot, scenes, groups)
+    print(SUMMARY_PREFIX + json.dumps({"changes": changes}))
+    if changes and not args.dry_run:
+        bpy.ops.wm.save_mainfile()
 
 
 if __name__ == "__main__":
-    register()
+    if "--" in sys.argv:
+        main(sys.argv[sys.argv.index("--") + 1:])
+    else:
+        register()
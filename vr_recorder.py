@@ -1,8 +1,16 @@
 import bpy
+import csv
 import math
+import re
+import time
+import struct
+import numpy as np
 from pathlib import Path
-from bpy.props import StringProperty, CollectionProperty, IntProperty, BoolProperty, PointerProperty
+from mathutils import Matrix, Quaternion
+from bpy.props import StringProperty, CollectionProperty, IntProperty, FloatProperty, BoolProperty, PointerProperty, EnumProperty
 from bpy.types import Operator, Panel, UIList, PropertyGroup
+from bpy_extras.io_utils import ImportHelper
+from bpy.app.handlers import persistent
 
 
 def stop_recording(scene):
@@ -31,26 +39,481 @@ def create_recorder_empty(context, name):
     return object
 
 
-def record_handler(scene, cam_ob):
-    ''' Write keyframes to action of Camera_helper_Empty '''
-    frame = scene.frame_current
-    # get the object controlled by the tracker, to get its motion
-    vr_cam = bpy.data.objects.get(scene.vp_camera)
-    cam_ob = bpy.data.objects.get("Camera_helper_Empty")
-    cam_ob.matrix_world = vr_cam.matrix_world
-    # write keyframes
-    # cam_ob.rotation_euler[1] = cam_ob.rotation_euler[1] - vr_cam.rotation_euler[1]
-    cam_ob.keyframe_insert(data_path="location", frame=frame)
-    cam_ob.keyframe_insert(data_path="rotation_euler", frame=frame)
+# enum value of 'LINEAR' keyframe interpolation for foreach_set
+KEY_INTERPOLATION_LINEAR = 1
+
+
+def write_fcurves(action, data_path, frames, values, linear=False):
+    ''' Replace the F-curves of data_path with one key per frame, written in bulk '''
+    for index in range(values.shape[1]):
+        fcurve = action.fcurves.find(data_path, index=index)
+        if fcurve:
+            action.fcurves.remove(fcurve)
+        fcurve = action.fcurves.new(data_path, index=index, action_group="Object Transforms")
+        fcurve.keyframe_points.add(len(frames))
+        co = np.empty(len(frames) * 2, dtype=np.float32)
+        co[0::2] = frames
+        co[1::2] = values[:, index]
+        fcurve.keyframe_points.foreach_set("co", co)
+        if linear:
+            fcurve.keyframe_points.foreach_set("interpolation", np.full(len(frames), KEY_INTERPOLATION_LINEAR, dtype=np.int32))
+        # sort the keys and calculate the handles
+        fcurve.update()
+
+
+def savgol_smooth(values, window, order=2):
+    ''' Savitzky-Golay filter over every column, the ends are mirrored '''
+    half = window // 2
+    if half < 1 or len(values) <= half:
+        return values
+    offsets = np.arange(-half, half + 1)
+    # the first row of the pseudo inverse gives the weights for the smoothed center value
+    weights = np.linalg.pinv(np.vander(offsets, order + 1, increasing=True))[0]
+    padded = np.pad(values, ((half, half), (0, 0)), mode='reflect')
+    smoothed = np.zeros_like(values)
+    for k, weight in enumerate(weights):
+        smoothed += weight * padded[k:k + len(values)]
+    return smoothed
+
+
+def one_euro_smooth(times, values, min_cutoff, beta, d_cutoff=1.0):
+    ''' One-Euro filter, smooths slow motion strongly and fast motion lightly '''
+    def alpha(cutoff, dt):
+        tau = 1.0 / (2.0 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    smoothed = np.empty_like(values)
+    smoothed[0] = values[0]
+    speed = np.zeros(values.shape[1], dtype=values.dtype)
+    for i in range(1, len(values)):
+        dt = max(times[i] - times[i - 1], 1e-6)
+        a = alpha(d_cutoff, dt)
+        speed = a * (values[i] - smoothed[i - 1]) / dt + (1.0 - a) * speed
+        a = alpha(min_cutoff + beta * np.abs(speed), dt)
+        smoothed[i] = a * values[i] + (1.0 - a) * smoothed[i - 1]
+    return smoothed
+
+
+def reduce_keys(frames, values, tolerance):
+    ''' Indices of the keys needed so the linear interpolation stays within tolerance on all columns '''
+    count = len(frames)
+    if count < 3 or tolerance <= 0:
+        return np.arange(count)
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    segments = [(0, count - 1)]
+    while segments:
+        first, last = segments.pop()
+        if last - first < 2:
+            continue
+        t = (frames[first + 1:last] - frames[first]) / max(frames[last] - frames[first], 1e-9)
+        line = values[first] + t[:, None] * (values[last] - values[first])
+        error = np.abs(values[first + 1:last] - line).max(axis=1)
+        worst = int(error.argmax())
+        if error[worst] > tolerance:
+            split = first + 1 + worst
+            keep[split] = True
+            segments.append((first, split))
+            segments.append((split, last))
+    return np.flatnonzero(keep)
+
+
+def unwrap_quaternions(quats):
+    ''' Flip quaternions so each one is on the same side as the previous one, q and -q are the same rotation '''
+    if len(quats) < 2:
+        return quats
+    dots = np.einsum('ij,ij->i', quats[1:], quats[:-1])
+    signs = np.cumprod(np.where(dots < 0, -1.0, 1.0))
+    quats[1:] *= signs[:, None].astype(quats.dtype)
+    return quats
+
+
+def quaternions_to_eulers(quats, order='XYZ'):
+    ''' Convert to Euler rotations that stay close to the previous one, so there are no flips '''
+    eulers = np.empty((len(quats), 3), dtype=np.float32)
+    previous = None
+    for i, quat in enumerate(quats):
+        if previous is None:
+            previous = Quaternion(quat).to_euler(order)
+        else:
+            previous = Quaternion(quat).to_euler(order, previous)
+        eulers[i] = previous
+    return eulers
+
+
+def match_rotation_mode(ob, action):
+    ''' Use quaternion rotation on objects playing back a quaternion take '''
+    if action and action.fcurves.find("rotation_quaternion"):
+        ob.rotation_mode = 'QUATERNION'
+    elif ob.rotation_mode in {'QUATERNION', 'AXIS_ANGLE'}:
+        ob.rotation_mode = 'XYZ'
+
+
+class TakeRecorder():
+    ''' Sample the VR camera into a preallocated ring buffer during playback and write the take in one go '''
+
+    def __init__(self, scene, vr_cam, cam_ob):
+        self.scene = scene
+        self.vr_cam = vr_cam
+        self.cam_ob = cam_ob
+        self.mode = scene.vp_capture_mode
+        self.fps = scene.render.fps / scene.render.fps_base
+        if self.mode == 'FRAME':
+            rate = self.fps
+        else:
+            rate = scene.vp_capture_rate
+        self.interval = 1.0 / rate
+        # room for the whole frame range with some headroom for late stops,
+        # if a take runs longer the oldest samples are overwritten
+        duration = (scene.frame_end - scene.frame_start + 1) / self.fps
+        capacity = int(duration * rate * 1.5) + 16
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.frames = np.zeros(capacity, dtype=np.int32)
+        # location and rotation quaternion of every sample
+        self.samples = np.zeros((capacity, 7), dtype=np.float32)
+        self.head = 0
+        self.count = 0
+        # keep the bound method, so the timer can be found again
+        self.timer = self.sample
+
+    def sample(self):
+        ''' Timer callback, stores the VR camera with a monotonic timestamp '''
+        head = self.head
+        location, rotation, scale = self.vr_cam.matrix_world.decompose()
+        self.times[head] = time.monotonic()
+        self.frames[head] = self.scene.frame_current
+        self.samples[head, :3] = location
+        self.samples[head, 3:] = rotation
+        self.head = (head + 1) % len(self.times)
+        self.count = min(self.count + 1, len(self.times))
+        return self.interval
+
+    def start(self):
+        bpy.app.timers.register(self.timer, first_interval=0.0)
+
+    def stop(self):
+        if bpy.app.timers.is_registered(self.timer):
+            bpy.app.timers.unregister(self.timer)
+
+    def ordered(self, buffer):
+        ''' The valid part of a ring buffer, oldest sample first '''
+        if self.count < len(buffer):
+            return buffer[:self.count].copy()
+        return np.concatenate((buffer[self.head:], buffer[:self.head]))
+
+    def keys(self):
+        ''' Frames and values of the keys to write, depending on the capture mode '''
+        times = self.ordered(self.times)
+        samples = self.ordered(self.samples)
+        # interpolating and filtering only works if neighbouring quaternions are on the same side
+        samples[:, 3:] = unwrap_quaternions(samples[:, 3:])
+        frames = self.ordered(self.frames)
+        if self.mode == 'FRAME':
+            # one key per scene frame, the last sample of a frame wins
+            frames, index = np.unique(frames[::-1], return_index=True)
+            return frames.astype(np.float64), samples[::-1][index]
+
+        # position of every sample on the timeline: the scene frame it was taken on,
+        # plus the clock time since that frame was first sampled. playback can drop or
+        # hold frames, so the clock alone drifts away from what was actually played
+        new_frame = np.ones(len(frames), dtype=bool)
+        new_frame[1:] = frames[1:] != frames[:-1]
+        frame_times = times[new_frame][np.cumsum(new_frame) - 1]
+        # a held frame doesn't run into the next one
+        subframes = frames + np.clip((times - frame_times) * self.fps, 0.0, 0.999)
+        # samples clamped onto the same subframe, or taken after a jump back, are dropped
+        latest = np.maximum.accumulate(subframes)
+        keep = np.ones(len(subframes), dtype=bool)
+        keep[1:] = subframes[1:] > latest[:-1]
+        subframes, samples = subframes[keep], samples[keep]
+        if self.mode == 'SUBFRAME':
+            return subframes, samples
+        frames = np.arange(math.ceil(subframes[0]), math.floor(subframes[-1]) + 1, dtype=np.float64)
+        values = np.empty((len(frames), samples.shape[1]), dtype=np.float32)
+        for channel in range(samples.shape[1]):
+            values[:, channel] = np.interp(frames, subframes, samples[:, channel])
+        return frames, values
+
+    def smooth(self, frames, values):
+        ''' Filter the take with the smoothing of the scene '''
+        scene = self.scene
+        if scene.vp_smoothing == 'SAVGOL':
+            values = savgol_smooth(values, scene.vp_smoothing_window)
+        elif scene.vp_smoothing == 'ONE_EURO':
+            values = one_euro_smooth(frames / self.fps, values, scene.vp_smoothing_cutoff, scene.vp_smoothing_beta)
+        # interpolated and filtered quaternions are not unit length anymore
+        values[:, 3:] /= np.linalg.norm(values[:, 3:], axis=1)[:, None]
+        return values
+
+    def write(self):
+        ''' Write the recorded take as location and rotation keys of the recorder object, returns the action '''
+        if not self.count:
+            return None
+        frames, values = self.keys()
+        if not len(frames):
+            return None
+        values = self.smooth(frames, values)
+        cam_ob = self.cam_ob
+        if not cam_ob.animation_data:
+            cam_ob.animation_data_create()
+        if not cam_ob.animation_data.action:
+            cam_ob.animation_data.action = bpy.data.actions.new(f'{cam_ob.name}Action')
+        action = cam_ob.animation_data.action
+        if self.scene.vp_rotation_mode == 'QUATERNION':
+            rotation_path = "rotation_quaternion"
+            rotations = values[:, 3:]
+        else:
+            rotation_path = "rotation_euler"
+            rotations = quaternions_to_eulers(values[:, 3:])
+        # a take has either quaternion or euler curves
+        for data_path in ("rotation_euler", "rotation_quaternion"):
+            for fcurve in [fc for fc in action.fcurves if fc.data_path == data_path]:
+                action.fcurves.remove(fcurve)
+        # drop the keys that are not needed to stay within the tolerance,
+        # the tolerance is measured against straight lines so reduced keys are linear
+        tolerance = self.scene.vp_reduce_tolerance
+        linear = tolerance > 0
+        keep = reduce_keys(frames, values[:, :3], tolerance)
+        write_fcurves(action, "location", frames[keep], values[keep, :3], linear)
+        keep = reduce_keys(frames, rotations, tolerance)
+        write_fcurves(action, rotation_path, frames[keep], rotations[keep], linear)
+        match_rotation_mode(cam_ob, action)
+        return action
+
+
+def register_shot(scene, action, lens):
+    ''' Add an action to the shot list, or update its entry if it is already listed '''
+    shots = scene.vp_shot_list
+    shot = next((s for s in shots if s.action == action), None)
+    if shot is None:
+        shot = shots.add()
+        shot.take = max(s.take for s in shots) + 1
+        scene.vp_shot_list_index = len(shots) - 1
+    shot.action = action
+    shot.name = action.name
+    start, end = action.frame_range
+    shot.duration = end - start
+    shot.lens = lens
+    return shot
+
+
+def migrate_shot_list(scene):
+    ''' Move takes of files from before the shot registry into the shot list '''
+    if scene.get("vp_shots_migrated"):
+        return
+    shots = scene.vp_shot_list
+    # the old list showed bpy.data.actions and only held empty placeholder items
+    for index in reversed(range(len(shots))):
+        if shots[index].action is None:
+            shots.remove(index)
+    # recorded takes end in _CAM, or _CAM.001 for repeated takes, and have a fake user.
+    # the shot name may have changed since, so it is not part of the match
+    take_name = re.compile(r"_CAM(\.\d+)?$")
+    listed = {s.action for s in shots}
+    cam = bpy.data.objects.get(scene.vp_camera)
+    lens = cam.data.lens if cam and cam.type == 'CAMERA' else 0.0
+    for action in bpy.data.actions:
+        if action.use_fake_user and take_name.search(action.name) and action not in listed:
+            register_shot(scene, action, lens)
+    scene.vp_shot_list_index = min(scene.vp_shot_list_index, len(shots) - 1)
+    scene["vp_shots_migrated"] = True
+
+
+@persistent
+def migrate_shot_lists(dummy):
+    for scene in bpy.data.scenes:
+        migrate_shot_list(scene)
+
+
+def migrate_open_file():
+    # the file that is open when the addon is enabled doesn't get a load_post
+    migrate_shot_lists(None)
+    return None
+
+
+def get_active_shot(scene):
+    ''' The selected shot, if it still has an action '''
+    shots = scene.vp_shot_list
+    index = scene.vp_shot_list_index
+    if 0 <= index < len(shots) and shots[index].action:
+        return shots[index]
+    return None
+
+
+def quaternion_matrices(quats):
+    ''' Rotation matrices of quaternions (w, x, y, z), one per row '''
+    w, x, y, z = (quats / np.linalg.norm(quats, axis=1)[:, None]).T
+    return np.stack((
+        np.stack((1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)), axis=1),
+        np.stack((2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)), axis=1),
+        np.stack((2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)), axis=1),
+        ), axis=1)
+
+
+def euler_quaternions(eulers):
+    ''' Quaternions (w, x, y, z) of XYZ Euler rotations, one per row '''
+    cx, cy, cz = np.cos(eulers / 2).T
+    sx, sy, sz = np.sin(eulers / 2).T
+    return np.stack((
+        cx * cy * cz + sx * sy * sz,
+        sx * cy * cz - cx * sy * sz,
+        cx * sy * cz + sx * cy * sz,
+        cx * cy * sz - sx * sy * cz,
+        ), axis=1)
+
+
+def bake_action_transforms(action, frames):
+    ''' Location and rotation quaternion of an object playing the action, one row per frame '''
+    def channel(data_path, index, default):
+        fcurve = action.fcurves.find(data_path, index=index)
+        if fcurve is None:
+            return np.full(len(frames), default)
+        return np.array([fcurve.evaluate(frame) for frame in frames])
+
+    location = np.stack([channel("location", i, 0.0) for i in range(3)], axis=1)
+    if action.fcurves.find("rotation_quaternion"):
+        quats = np.stack([channel("rotation_quaternion", i, 1.0 if i == 0 else 0.0) for i in range(4)], axis=1)
+    else:
+        quats = euler_quaternions(np.stack([channel("rotation_euler", i, 0.0) for i in range(3)], axis=1))
+    return location, unwrap_quaternions(quats)
+
+
+def bake_action_matrices(action, frames):
+    ''' World matrices of an unparented object playing the action, one per frame '''
+    location, quats = bake_action_transforms(action, frames)
+    matrices = np.zeros((len(frames), 4, 4))
+    matrices[:, :3, :3] = quaternion_matrices(quats)
+    matrices[:, :3, 3] = location
+    matrices[:, 3, 3] = 1.0
+    return matrices
+
+
+# ghost camera objects of the shot comparison and their baked matrices
+compare_cache = {}
+
+
+def compare_handler(scene):
+    ''' Move the ghost cameras from the baked matrices, no action is evaluated '''
+    for ghost, (frame_start, matrices) in compare_cache.items():
+        index = min(max(scene.frame_current - frame_start, 0), len(matrices) - 1)
+        ghost.matrix_world = Matrix(matrices[index])
+
+
+# columns of an exported camera track
+TRACK_COLUMNS = ("time", "px", "py", "pz", "qw", "qx", "qy", "qz", "lens")
+# binary tracks: magic, version, frames per second, number of rows, followed by float32 rows
+TRACK_HEADER = struct.Struct("<4sHdI")
+TRACK_MAGIC = b"VPTK"
+TRACK_CHUNK = 65536
+
+
+def export_track(filepath, shot, fps):
+    ''' Write a shot as camera track, one row per frame of its action '''
+    start, end = shot.action.frame_range
+    frames = np.arange(math.floor(start), math.ceil(end) + 1, dtype=np.float64)
+    location, quats = bake_action_transforms(shot.action, frames)
+    rows = np.empty((len(frames), len(TRACK_COLUMNS)), dtype=np.float32)
+    rows[:, 0] = (frames - frames[0]) / fps
+    rows[:, 1:4] = location
+    rows[:, 4:8] = quats
+    rows[:, 8] = shot.lens
+    if filepath.endswith(".csv"):
+        with open(filepath, "w", newline="") as f:
+            f.write(f"# fps={fps}\n")
+            f.write(",".join(TRACK_COLUMNS) + "\n")
+            np.savetxt(f, rows, delimiter=",", fmt="%.7g")
+    else:
+        with open(filepath, "wb") as f:
+            f.write(TRACK_HEADER.pack(TRACK_MAGIC, 1, fps, len(rows)))
+            rows.tofile(f)
+
+
+def read_track(filepath):
+    ''' Read a camera track in chunks, returns its frames per second and rows '''
+    chunks = []
+    if filepath.endswith(".csv"):
+        with open(filepath, newline="") as f:
+            fps = float(f.readline().strip("# \n").split("=")[1])
+            reader = csv.reader(f)
+            next(reader)
+            chunk = []
+            for row in reader:
+                chunk.append(row)
+                if len(chunk) == TRACK_CHUNK:
+                    chunks.append(np.array(chunk, dtype=np.float32))
+                    chunk = []
+            if chunk:
+                chunks.append(np.array(chunk, dtype=np.float32))
+    else:
+        with open(filepath, "rb") as f:
+            magic, version, fps, count = TRACK_HEADER.unpack(f.read(TRACK_HEADER.size))
+            if magic != TRACK_MAGIC:
+                raise ValueError(f"{filepath} is not a camera track")
+            while count:
+                chunk = np.fromfile(f, dtype=np.float32, count=min(count, TRACK_CHUNK) * len(TRACK_COLUMNS))
+                if not len(chunk):
+                    break
+                chunks.append(chunk.reshape(-1, len(TRACK_COLUMNS)))
+                count -= len(chunks[-1])
+    if not chunks:
+        return fps, np.zeros((0, len(TRACK_COLUMNS)), dtype=np.float32)
+    return fps, np.concatenate(chunks)
+
+
+def import_track(filepath, scene):
+    ''' Create an action from a camera track and add it to the shot list '''
+    track_fps, rows = read_track(filepath)
+    if not len(rows):
+        return None
+    # the time column is in seconds, so the frames follow the frame rate of the importing scene
+    fps = scene.render.fps / scene.render.fps_base
+    frames = scene.frame_start + rows[:, 0].astype(np.float64) * fps
+    action = bpy.data.actions.new(Path(filepath).stem)
+    action.use_fake_user = True
+    # frame rate the track was exported with, only kept for information
+    action["vp_track_fps"] = track_fps
+    write_fcurves(action, "location", frames, rows[:, 1:4])
+    quats = unwrap_quaternions(rows[:, 4:8].copy())
+    if scene.vp_rotation_mode == 'QUATERNION':
+        write_fcurves(action, "rotation_quaternion", frames, quats)
+    else:
+        write_fcurves(action, "rotation_euler", frames, quaternions_to_eulers(quats))
+    return register_shot(scene, action, float(rows[0, 8]))
+
+
+# the take that is currently recorded
+active_take = None
 
 
 class ListItem(PropertyGroup):
-    '''List of shot actions'''
+    '''Recorded shot, referencing its action'''
     name:  StringProperty(
             name="ActionName",
             description="Name of the action",
             default="shot"
             )
+    action: PointerProperty(
+            name="Action",
+            type=bpy.types.Action,
+            description="The action of the shot"
+            )
+    take: IntProperty(
+            name="Take",
+            description="Number of the take"
+            )
+    duration: FloatProperty(
+            name="Duration",
+            description="Length of the shot in frames"
+            )
+    lens: FloatProperty(
+            name="Lens",
+            description="Focal length of the VP camera when the shot was recorded"
+            )
+    select: BoolProperty(
+            name="Select",
+            description="Select the shot for comparing and exporting",
+            default=False
+            )
 
 
 class VP_UL_shot_list(UIList):
@@ -59,7 +522,12 @@ class VP_UL_shot_list(UIList):
         custom_icon = 'OBJECT_DATAMODE'
 
         if self.layout_type in {'DEFAULT', 'COMPACT'}:
-            layout.prop(item, "name", text="", icon_value=icon, emboss=False)
+            row = layout.row()
+            # the action of the shot may have been deleted
+            row.active = item.action is not None
+            row.prop(item, "name", text="", icon_value=icon, emboss=False)
+            row.label(text=f"#{item.take}  {int(item.duration)}f  {item.lens:.0f}mm")
+            row.prop(item, "select", text="")
 
         elif self.layout_type in {'GRID'}:
             layout.alignment='CENTER'
@@ -67,12 +535,19 @@ class VP_UL_shot_list(UIList):
 
 
 class VP_OT_add_shot(Operator):
-    '''Add a new shot'''
+    '''Add the action of the active object as a new shot'''
     bl_idname = "scene.add_vp_shot"
     bl_label = "Add VP Shot"
 
+    @classmethod
+    def poll(cls, context):
+        ob = context.object
+        return ob and ob.animation_data and ob.animation_data.action
+
     def execute(self, context):
-        context.scene.vp_shot_list.add()
+        ob = context.object
+        lens = ob.data.lens if ob.type == 'CAMERA' else 0.0
+        register_shot(context.scene, ob.animation_data.action, lens)
         return {'FINISHED'}
 
 
@@ -83,7 +558,7 @@ class VP_OT_play_shot(Operator):
 
     @classmethod
     def poll(cls, context):
-        return bpy.data.objects.get(context.scene.vp_camera)
+        return bpy.data.objects.get(context.scene.vp_camera) and get_active_shot(context.scene)
 
     def modal(self, context, event):
         '''run modal until we cancel'''
@@ -99,9 +574,9 @@ class VP_OT_play_shot(Operator):
     def execute(self, context):
         data = bpy.data
         scene = context.scene
-        # get the action by addressing the index
-        index = context.scene.vp_shot_list_index
-        action = data.actions[index]
+        # get the action of the selected shot
+        shot = get_active_shot(scene)
+        action = shot.action
 
         # initirate handler
         wm = context.window_manager
@@ -122,13 +597,14 @@ class VP_OT_play_shot(Operator):
 
         player.data = player_cam
         # configure camera data
-        player_cam.lens = vp_camera.data.lens
+        player_cam.lens = shot.lens if shot.lens else vp_camera.data.lens
         player_cam.sensor_width = vp_camera.data.sensor_width
         # link player data to temp camera object
 
         # assign action to the player
         player.animation_data_create()
         player.animation_data.action = action
+        match_rotation_mode(player, action)
 
         # make player the active camera
         scene.camera = player
@@ -150,6 +626,130 @@ class VP_OT_play_shot(Operator):
         return {'FINISHED'}
 
 
+class VP_OT_compare_shots(Operator):
+    '''Play all selected shots at the same time with ghost cameras'''
+    bl_idname = "scene.vp_compare_shots"
+    bl_label = "Compare Shots"
+
+    @classmethod
+    def poll(cls, context):
+        return any(s.select and s.action for s in context.scene.vp_shot_list)
+
+    def modal(self, context, event):
+        '''run modal until we cancel'''
+        scene = context.scene
+        if event.type in {'RIGHTMOUSE', 'ESC'}:
+            self.cancel(context)
+            return {'CANCELLED'}
+        if scene.frame_current == scene.frame_end:
+            self.cancel(context)
+            return {'FINISHED'}
+        return {'PASS_THROUGH'}
+
+    def execute(self, context):
+        data = bpy.data
+        scene = context.scene
+        vp_camera = data.objects.get(scene.vp_camera)
+        frames = np.arange(scene.frame_start, scene.frame_end + 1)
+
+        # bake every take once, playback only reads the matrices
+        compare_cache.clear()
+        for shot in scene.vp_shot_list:
+            if not shot.select or not shot.action:
+                continue
+            ghost_cam = data.cameras.new(f"vp_compare_{shot.take}")
+            if vp_camera and vp_camera.type == 'CAMERA':
+                ghost_cam.lens = vp_camera.data.lens
+                ghost_cam.sensor_width = vp_camera.data.sensor_width
+            if shot.lens:
+                ghost_cam.lens = shot.lens
+            ghost = data.objects.new(f"vp_compare_{shot.name}", ghost_cam)
+            ghost.show_name = True
+            scene.collection.objects.link(ghost)
+            compare_cache[ghost] = (scene.frame_start, bake_action_matrices(shot.action, frames))
+
+        if vp_camera:
+            vp_camera.hide_viewport = True
+        bpy.app.handlers.frame_change_post.append(compare_handler)
+        scene.frame_current = scene.frame_start
+        compare_handler(scene)
+
+        context.window_manager.modal_handler_add(self)
+        bpy.ops.screen.animation_play()
+        return {'RUNNING_MODAL'}
+
+    def cancel(self, context):
+        '''cancel animation and remove the ghost cameras'''
+        scene = context.scene
+        bpy.ops.screen.animation_cancel(restore_frame=True)
+        if compare_handler in bpy.app.handlers.frame_change_post:
+            bpy.app.handlers.frame_change_post.remove(compare_handler)
+        for ghost in compare_cache:
+            ghost_cam = ghost.data
+            bpy.data.objects.remove(ghost)
+            bpy.data.cameras.remove(ghost_cam)
+        compare_cache.clear()
+        cam = bpy.data.objects.get(scene.vp_camera)
+        if cam:
+            cam.hide_viewport = False
+        return {'FINISHED'}
+
+
+class VP_OT_export_shots(Operator):
+    '''Export the selected shots as camera tracks'''
+    bl_idname = "scene.vp_export_shots"
+    bl_label = "Export Shots"
+
+    directory: StringProperty(subtype='DIR_PATH')
+    file_format: EnumProperty(
+            name="Format",
+            items=(
+                ('VPTK', "Binary", "Compact binary camera track"),
+                ('CSV', "CSV", "Camera track as text, readable by other applications"),
+                ),
+            default='VPTK'
+            )
+
+    @classmethod
+    def poll(cls, context):
+        return any(s.select and s.action for s in context.scene.vp_shot_list)
+
+    def invoke(self, context, event):
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        scene = context.scene
+        fps = scene.render.fps / scene.render.fps_base
+        suffix = ".csv" if self.file_format == 'CSV' else ".vptk"
+        count = 0
+        for shot in scene.vp_shot_list:
+            if shot.select and shot.action:
+                export_track(str(Path(self.directory) / (bpy.path.clean_name(shot.name) + suffix)), shot, fps)
+                count += 1
+        self.report({'INFO'}, f"Exported {count} shots")
+        return {'FINISHED'}
+
+
+class VP_OT_import_shots(Operator, ImportHelper):
+    '''Import camera tracks as new shots'''
+    bl_idname = "scene.vp_import_shots"
+    bl_label = "Import Shots"
+
+    filter_glob: StringProperty(default="*.vptk;*.csv", options={'HIDDEN'})
+    files: CollectionProperty(type=bpy.types.OperatorFileListElement, options={'HIDDEN', 'SKIP_SAVE'})
+    directory: StringProperty(subtype='DIR_PATH')
+
+    def execute(self, context):
+        for f in self.files:
+            filepath = str(Path(self.directory) / f.name)
+            try:
+                import_track(filepath, context.scene)
+            except (OSError, ValueError, IndexError) as e:
+                self.report({'ERROR'}, f"Could not import {filepath}: {e}")
+        return {'FINISHED'}
+
+
 class VP_OT_delete_shot(Operator):
     '''Delete Selected Shot'''
     bl_idname = "scene.delete_item"
@@ -162,7 +762,13 @@ class VP_OT_delete_shot(Operator):
     def execute(self, context):
         scene = context.scene
         index = context.scene.vp_shot_list_index
-        bpy.data.actions.remove(bpy.data.actions[index])
+        shots = scene.vp_shot_list
+        if not 0 <= index < len(shots):
+            return {'CANCELLED'}
+        if shots[index].action:
+            bpy.data.actions.remove(shots[index].action)
+        shots.remove(index)
+        scene.vp_shot_list_index = min(index, len(shots) - 1)
 
         return{'FINISHED'}
 
@@ -170,19 +776,20 @@ class VP_OT_delete_shot(Operator):
 class VP_OT_use_shot(Operator):
     '''Assign selected shot to camera'''
     bl_idname = "scene.use_shot"
-    bl_label = "Delete VP Shot"
+    bl_label = "Use VP Shot"
 
     @classmethod
     def poll(cls, context):
-        return (context.scene.vp_shot_list and bpy.data.objects.get(context.scene.scene_camera))
+        return (get_active_shot(context.scene) and bpy.data.objects.get(context.scene.scene_camera))
 
     def execute(self, context):
         scene = context.scene
-        index = context.scene.vp_shot_list_index
+        shot = get_active_shot(scene)
         cam = bpy.data.objects[scene.scene_camera]
         if cam.animation_data is None:
             cam.animation_data_create()
-        cam.animation_data.action = bpy.data.actions[index]
+        cam.animation_data.action = shot.action
+        match_rotation_mode(cam, cam.animation_data.action)
 
         return{'FINISHED'}
 
@@ -248,15 +855,14 @@ class VIEW_3D_OT_vp_start_recording(Operator):
 
         # assign or create the recorder object
         cam_ob = create_recorder_empty(context, "Camera_helper_Empty")
-        if not scene.vp_action_overwrite:
-            action = cam_ob.animation_data.action
-            bpy.ops.scene.add_vp_shot()
-        else:
+        if scene.vp_action_overwrite:
             cam_ob.animation_data_clear()
 
-        # play and handle recording
+        # play and sample the VR camera until recording stops
+        global active_take
+        active_take = TakeRecorder(scene, cam, cam_ob)
         bpy.ops.screen.animation_play()
-        bpy.app.handlers.frame_change_post.append(record_handler)
+        active_take.start()
         return {'FINISHED'}
 
 
@@ -273,10 +879,16 @@ class VIEW_3D_OT_vp_stop_recording(Operator):
         scene = context.scene
         cam = bpy.data.objects.get(context.scene.vp_camera)
         cam_ob = bpy.data.objects.get("Camera_helper_Empty")
-        # stop animation and remove handler
+        # stop animation and write the recorded take
+        global active_take
         bpy.ops.screen.animation_cancel(restore_frame=False)
-        if record_handler in bpy.app.handlers.frame_change_post:
-            bpy.app.handlers.frame_change_post.remove(record_handler)
+        if active_take:
+            active_take.stop()
+            action = active_take.write()
+            if action:
+                lens = cam.data.lens if cam.type == 'CAMERA' else 0.0
+                register_shot(scene, action, lens)
+            active_take = None
 
         # set autokey back to what it was
         scene.tool_settings.use_keyframe_insert_auto = scene.autokeysetting
@@ -299,6 +911,17 @@ class VIEW_3D_PT_vp_recorder(Panel):
         layout.prop(scene, "scene_camera")
         layout.prop(scene, "vp_action_overwrite")
         layout.prop(scene, "vp_action_name")
+        layout.prop(scene, "vp_capture_mode")
+        if not scene.vp_capture_mode == 'FRAME':
+            layout.prop(scene, "vp_capture_rate")
+        layout.prop(scene, "vp_rotation_mode")
+        layout.prop(scene, "vp_smoothing")
+        if scene.vp_smoothing == 'SAVGOL':
+            layout.prop(scene, "vp_smoothing_window")
+        elif scene.vp_smoothing == 'ONE_EURO':
+            layout.prop(scene, "vp_smoothing_cutoff")
+            layout.prop(scene, "vp_smoothing_beta")
+        layout.prop(scene, "vp_reduce_tolerance")
 
         row = layout.row(align=True)
         row.label(text="Focus")
@@ -327,16 +950,24 @@ class VIEW_3D_PT_vp_playback(Panel):
         row = layout.row()
         col = row.column()
         ob = context.object
-        col.template_list("VP_UL_shot_list", "", bpy.data, "actions", scene, "vp_shot_list_index")
+        col.template_list("VP_UL_shot_list", "", scene, "vp_shot_list", scene, "vp_shot_list_index")
+        col.operator("scene.add_vp_shot", text="Add Shot from Active Object")
         col.operator("scene.vp_play_shot")
+        col.operator("scene.vp_compare_shots")
         col.operator("scene.delete_item", text="Remove Shot")
         col.operator("scene.use_shot", text="Use Shot")
+        row = col.row(align=True)
+        row.operator("scene.vp_import_shots", text="Import")
+        row.operator("scene.vp_export_shots", text="Export")
 
 
 classes = (
         ListItem,
         VP_UL_shot_list,
         VP_OT_play_shot,
+        VP_OT_compare_shots,
+        VP_OT_export_shots,
+        VP_OT_import_shots,
         VP_OT_delete_shot,
         VP_OT_use_shot,
         VP_OT_add_shot,
@@ -377,6 +1008,65 @@ def register():
             default=False,
             description="Overwrite VP action or create a new one"
             )
+    bpy.types.Scene.vp_capture_mode = EnumProperty(
+            name="Capture",
+            items=(
+                ('FRAME', "Per Frame", "Sample the VR camera once per scene frame"),
+                ('RESAMPLE', "High Rate", "Sample the VR camera at the capture rate and resample to the scene frames"),
+                ('SUBFRAME', "Sub-Frame Keys", "Sample the VR camera at the capture rate and key every sample, e.g. for motion blur"),
+                ),
+            default='FRAME'
+            )
+    bpy.types.Scene.vp_capture_rate = IntProperty(
+            name="Capture Rate",
+            default=90,
+            min=1,
+            max=1000,
+            description="Samples per second of the VR camera, usually the refresh rate of the headset"
+            )
+    bpy.types.Scene.vp_rotation_mode = EnumProperty(
+            name="Rotation",
+            items=(
+                ('EULER', "Euler", "Write flip free Euler rotation curves"),
+                ('QUATERNION', "Quaternion", "Write quaternion rotation curves"),
+                ),
+            default='EULER'
+            )
+    bpy.types.Scene.vp_smoothing = EnumProperty(
+            name="Smoothing",
+            items=(
+                ('NONE', "None", "Keep the take as recorded"),
+                ('SAVGOL', "Savitzky-Golay", "Smooth with a polynomial fit over a window of samples, keeps the shape of moves"),
+                ('ONE_EURO', "One Euro", "Smooth jitter when the camera is slow, keep fast moves responsive"),
+                ),
+            default='NONE'
+            )
+    bpy.types.Scene.vp_smoothing_window = IntProperty(
+            name="Window",
+            default=7,
+            min=3,
+            max=99,
+            description="Number of samples used to smooth each sample"
+            )
+    bpy.types.Scene.vp_smoothing_cutoff = FloatProperty(
+            name="Min Cutoff",
+            default=1.0,
+            min=0.01,
+            description="Cutoff frequency in Hz when the camera is not moving, lower values smooth more"
+            )
+    bpy.types.Scene.vp_smoothing_beta = FloatProperty(
+            name="Speed Coefficient",
+            default=0.05,
+            min=0.0,
+            description="How fast the cutoff frequency rises with the speed of the camera"
+            )
+    bpy.types.Scene.vp_reduce_tolerance = FloatProperty(
+            name="Key Reduction",
+            default=0.0,
+            min=0.0,
+            precision=4,
+            description="Remove keys that can be interpolated within this distance (and angle in radians), 0 keeps all keys"
+            )
     bpy.types.Scene.vp_shot_list_index = IntProperty(
             name="Index of Shots",
             default=0
@@ -386,6 +1076,8 @@ def register():
             )
 
     bpy.app.handlers.frame_change_pre.append(stop_recording)
+    bpy.app.handlers.load_post.append(migrate_shot_lists)
+    bpy.app.timers.register(migrate_open_file, first_interval=0.0)
 
     # keymap
     wm = bpy.context.window_manager
@@ -402,6 +1094,9 @@ def unregister():
         bpy.utils.unregister_class(c)
 
     bpy.app.handlers.frame_change_pre.remove(stop_recording)
+    bpy.app.handlers.load_post.remove(migrate_shot_lists)
+    if bpy.app.timers.is_registered(migrate_open_file):
+        bpy.app.timers.unregister(migrate_open_file)
 
     for km, kmi in addon_keymaps:
         km.keymap_items.remove(kmi)
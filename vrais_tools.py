@@ -31,9 +31,15 @@ bl_info = {
 
 import bpy
 import os
+import time
+import json
+import hashlib
+import threading
 import http.client
+import numpy as np
 from bpy.props import *
 from math import radians
+from mathutils import Matrix
 from bpy.types import Operator, AddonPreferences
 from bpy.utils import register_class, unregister_class
 from addon_utils import check
@@ -59,6 +65,11 @@ class VraisTools(bpy.types.AddonPreferences):
 # ##########################################################
 
 
+# recommended resolutions for VRAIS
+VRAIS_CUBE_SIZE = 1280
+VRAIS_EQUI_HEIGHT = 2048
+
+
 # define the path of the resulting cubemap
 def configure_vrais_cubemap_path(scn):
     vs = scn.vrais_settings
@@ -204,12 +215,101 @@ def connector(new_scn, offset):
     links.new(last_node.outputs[0], output.inputs[0])
 
 
-# upload the vr rendering to vrais.io
-def vr_uploader(scn, path):
-    filepath = path
-    f = open(filepath, "rb")
-    chunk = f.read()
-    f.close()
+# view direction, image right and image up of the cubemap faces, relative to the
+# center of the panorama (x = right, y = forward, z = up).
+# These match the cameras of the Cube Map addon.
+CUBE_FACES = {
+    "NORTH": ((0, 1, 0), (1, 0, 0), (0, 0, 1)),
+    "EAST": ((1, 0, 0), (0, -1, 0), (0, 0, 1)),
+    "SOUTH": ((0, -1, 0), (-1, 0, 0), (0, 0, 1)),
+    "WEST": ((-1, 0, 0), (0, 1, 0), (0, 0, 1)),
+    "ZENITH": ((0, 0, 1), (1, 0, 0), (0, -1, 0)),
+    "NADIR": ((0, 0, -1), (1, 0, 0), (0, 1, 0)),
+    }
+# order of the faces in the cubemap stripe of one eye, same as in img_node_creator
+CUBE_STRIPE_ORDER = ("EAST", "WEST", "ZENITH", "NADIR", "NORTH", "SOUTH")
+
+# the lookup tables of the last converted resolution, they are several hundred MB
+# for 8K panoramas so only one set is kept
+cubemap_lookup_cache = {}
+
+
+# bilinear lookup tables from the stripe of one eye into an equirectangular image.
+# they only depend on the resolutions, so they are reused for the next panorama of the same size.
+def cubemap_lookup(size, width, height):
+    key = (size, width, height)
+    if key in cubemap_lookup_cache:
+        return cubemap_lookup_cache[key]
+    # free the tables of another resolution before building the new ones
+    cubemap_lookup_cache.clear()
+
+    # pixel centers of a face in the range -1..1, rows from top to bottom
+    a = (np.arange(size, dtype=np.float32) + 0.5) / size * 2.0 - 1.0
+    a, b = np.meshgrid(a, -a)
+    faces = []
+    for face in CUBE_STRIPE_ORDER:
+        d, r, t = (np.array(v, dtype=np.float32) for v in CUBE_FACES[face])
+        faces.append(d + a[..., None] * r + b[..., None] * t)
+    dirs = np.concatenate(faces, axis=1)
+    x, y, z = dirs[..., 0], dirs[..., 1], dirs[..., 2]
+
+    lon = np.arctan2(x, y)
+    lat = np.arctan2(z, np.hypot(x, y))
+    src_x = (lon / (2.0 * np.pi) + 0.5) * width - 0.5
+    src_y = np.clip((0.5 - lat / np.pi) * height - 0.5, 0, height - 1)
+
+    x0 = np.floor(src_x)
+    y0 = np.floor(src_y)
+    fx = (src_x - x0)[..., None]
+    fy = (src_y - y0)[..., None]
+    # the panorama wraps around horizontally but not vertically
+    x0 = x0.astype(np.int32)
+    y0 = y0.astype(np.int32)
+    x1 = (x0 + 1) % width
+    x0 = x0 % width
+    y1 = np.minimum(y0 + 1, height - 1)
+
+    lookup = (y0, y1, x0, x1, fx, fy)
+    cubemap_lookup_cache[key] = lookup
+    return lookup
+
+
+# resample one eye of an equirectangular image (rows top to bottom) into a stripe of 6 faces
+def equirect_to_stripe(pixels, size):
+    height, width = pixels.shape[:2]
+    y0, y1, x0, x1, fx, fy = cubemap_lookup(size, width, height)
+    top = pixels[y0, x0] * (1.0 - fx) + pixels[y0, x1] * fx
+    bottom = pixels[y1, x0] * (1.0 - fx) + pixels[y1, x1] * fx
+    return top * (1.0 - fy) + bottom * fy
+
+
+# convert a top-bottom stereo panorama into the 12 tile stripe of create_cubemap.
+# the left eye is on top, like Blender renders top-bottom stereo.
+def equirect_to_cubemap(pixels, size):
+    half = pixels.shape[0] // 2
+    left = equirect_to_stripe(pixels[:half], size)
+    right = equirect_to_stripe(pixels[half:half*2], size)
+    return np.concatenate((right, left), axis=1)
+
+
+# read the pixels of a Blender image into an array with rows from top to bottom
+def image_to_array(img):
+    x, y = img.size
+    pixels = np.empty(x * y * img.channels, dtype=np.float32)
+    try:
+        img.pixels.foreach_get(pixels)
+    except AttributeError:
+        pixels[:] = img.pixels[:]
+    return pixels.reshape(y, x, img.channels)[::-1]
+
+
+VRAIS_HOST = "vrais.io"
+VRAIS_UPLOAD_URL = "/api.php?cmd=uploadItem"
+VRAIS_IMAGE_TYPES = (".jpg", ".jpeg", ".png")
+
+
+# the headers vrais.io expects with every upload (without the API key)
+def upload_headers(scn, title):
     vs = scn.vrais_settings
     if scn.vrais_enum == 'VRAIS_CUBE':
         is_cubemap = "1"
@@ -219,22 +319,375 @@ def vr_uploader(scn, path):
     headers = {
         "Content-type": "multipart/form-data",
         "Accept": "text/plain",
-        "Title": vs.vrais_title,
+        "Title": title,
         "Description": vs.description,
-        "Token": bpy.context.user_preferences.addons[__name__].preferences.vrais_key,
         "Convergence": str(scn.camera.data.stereo.convergence_distance),
         "IsCubemap": is_cubemap
         }
+    return headers
 
-    conn = http.client.HTTPConnection("vrais.io")
-    conn.request("POST", "/api.php?cmd=uploadItem", chunk, headers)
+
+def get_vrais_key(context):
+    return context.user_preferences.addons[__name__].preferences.vrais_key
+
+
+# check if camera, title, description and API key are setup correctly
+# returns an error message or None if everything is fine
+def check_upload_settings(context):
+    scn = context.scene
+    vs = scn.vrais_settings
+    if not scn.camera.data.stereo.use_spherical_stereo:
+        return "Spherical Stereo was not enabled in camera settings. \
+                This will lead to wrong stereo effect!"
+    elif len(vs.description)==0:
+        return "Please fill in a description"
+    elif len(vs.vrais_title)==0:
+        return "Please fill in a Title"
+    elif len(get_vrais_key(context))<2:
+        return "No VRAIS API key configured in Addon Preferences!"
+    return None
+
+
+# send one file over an open connection, the connection stays open for the next upload
+def post_upload(conn, path, headers):
+    f = open(path, "rb")
+    chunk = f.read()
+    f.close()
+    conn.request("POST", VRAIS_UPLOAD_URL, chunk, headers)
     response = conn.getresponse()
     remote_file = response.read()
+    return response.status, remote_file
+
+
+# upload the vr rendering to vrais.io
+def vr_uploader(scn, path):
+    headers = upload_headers(scn, scn.vrais_settings.vrais_title)
+    headers["Token"] = get_vrais_key(bpy.context)
+
+    conn = http.client.HTTPConnection(VRAIS_HOST)
+    status, remote_file = post_upload(conn, path, headers)
     conn.close()
     print ("uploaded ", remote_file)
     return str(remote_file)
 
 
+# recommended maximum size of the uploaded image for each VR type
+VRAIS_MAX_RESOLUTION = {
+    'VRAIS_CUBE': (VRAIS_CUBE_SIZE*12, VRAIS_CUBE_SIZE),
+    'VRAIS_EQUI': (VRAIS_EQUI_HEIGHT*2, VRAIS_EQUI_HEIGHT*2),
+    }
+
+
+# convert the rendering to a JPEG in the recommended resolution before uploading.
+# the result is cached, the cache key contains the modification time of the source
+# and the transcode settings, so a new rendering or new settings create a new file.
+def transcode_for_upload(scn, path):
+    vs = scn.vrais_settings
+    max_x, max_y = VRAIS_MAX_RESOLUTION[scn.vrais_enum]
+    cache_dir = bpy.utils.user_resource('CONFIG', os.path.join("vrais", "transcode_cache"), autocreate=True)
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    prefix = "%s_%s" % (name, hashlib.sha1(path.encode()).hexdigest()[:8])
+    key = "%f|%d|%d|%d" % (os.path.getmtime(path), max_x, max_y, vs.jpeg_quality)
+    target = os.path.join(cache_dir, "%s_%s.jpg" % (prefix, hashlib.sha1(key.encode()).hexdigest()[:8]))
+    if os.path.exists(target):
+        return target
+
+    # older versions of the same source are not needed anymore
+    for f in os.listdir(cache_dir):
+        if f.startswith(prefix):
+            os.remove(os.path.join(cache_dir, f))
+
+    img = bpy.data.images.load(filepath=path)
+    try:
+        x, y = img.size
+        scale = min(1.0, max_x / x, max_y / y)
+        if scale < 1.0:
+            img.scale(max(1, int(x*scale)), max(1, int(y*scale)))
+        save_as_jpeg(scn, img, target, vs.jpeg_quality)
+    finally:
+        bpy.data.images.remove(img)
+    return target
+
+
+# save an image as JPEG, using the render settings of the scene only temporarily
+def save_as_jpeg(scn, img, target, quality):
+    settings = scn.render.image_settings
+    view = scn.view_settings
+    stored = [(owner, attr, getattr(owner, attr)) for owner, attr in (
+        (settings, "file_format"),
+        (settings, "color_mode"),
+        (settings, "quality"),
+        (scn.display_settings, "display_device"),
+        (view, "view_transform"),
+        (view, "look"),
+        (view, "exposure"),
+        (view, "gamma"),
+        (view, "use_curve_mapping"),
+        )]
+    try:
+        settings.file_format = 'JPEG'
+        settings.color_mode = 'RGB'
+        settings.quality = quality
+        # the rendering already has the color management of the scene, don't apply it a second time
+        scn.display_settings.display_device = 'sRGB'
+        view.view_transform = 'Default'
+        view.look = 'None'
+        view.exposure = 0.0
+        view.gamma = 1.0
+        view.use_curve_mapping = False
+        img.save_render(target, scn)
+    finally:
+        for owner, attr, value in stored:
+            setattr(owner, attr, value)
+
+
+# where the upload queue is stored between Blender sessions
+def upload_queue_path():
+    config_dir = bpy.utils.user_resource('CONFIG', "vrais", autocreate=True)
+    return os.path.join(config_dir, "upload_queue.json")
+
+
+class VraisUploadQueue():
+    """Upload many VR renderings in background threads.
+    Every worker keeps its own keep-alive connection to vrais.io open for all its uploads.
+    The queue is written to disk after every change, so it can be resumed after a restart."""
+
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self.items = []
+        self.token = ""
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def load(self):
+        if not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path) as f:
+                self.items = json.load(f)
+        except (OSError, ValueError):
+            print("could not read the VRAIS upload queue from", self.state_path)
+            self.items = []
+        # uploads that were running when Blender was closed have to be sent again
+        for item in self.items:
+            if item["status"] == 'UPLOADING':
+                item["status"] = 'PENDING'
+
+    def save(self):
+        # the API key is never written to disk, it is added when the queue starts
+        tmp_path = self.state_path + ".tmp"
+        with self.lock:
+            with open(tmp_path, "w") as f:
+                json.dump(self.items, f, indent=1)
+            os.replace(tmp_path, self.state_path)
+
+    def add(self, path, headers):
+        with self.lock:
+            for item in self.items:
+                if item["path"] == path and item["status"] in {'PENDING', 'UPLOADING'}:
+                    return False
+            self.items.append({
+                "path": path,
+                "headers": headers,
+                "status": 'PENDING',
+                "response": ""
+                })
+        self.save()
+        return True
+
+    def count(self, status):
+        with self.lock:
+            return len([i for i in self.items if i["status"] == status])
+
+    def clear_finished(self):
+        with self.lock:
+            self.items = [i for i in self.items if i["status"] != 'DONE']
+        self.save()
+
+    def retry_failed(self):
+        with self.lock:
+            for item in self.items:
+                if item["status"] == 'FAILED':
+                    item["status"] = 'PENDING'
+        self.save()
+
+    def is_running(self):
+        return any(t.is_alive() for t in self.threads)
+
+    def start(self, token, workers):
+        if self.is_running():
+            return
+        self.token = token
+        self.threads = [threading.Thread(target=self.worker, daemon=True) for i in range(workers)]
+        for t in self.threads:
+            t.start()
+
+    def next_item(self):
+        with self.lock:
+            for item in self.items:
+                if item["status"] == 'PENDING':
+                    item["status"] = 'UPLOADING'
+                    return item
+        return None
+
+    def finish_item(self, item, status, response):
+        with self.lock:
+            item["status"] = status
+            item["response"] = response
+        self.save()
+
+    def worker(self):
+        conn = None
+        while True:
+            item = self.next_item()
+            if item is None:
+                break
+            headers = dict(item["headers"])
+            headers["Token"] = self.token
+            # if the server closed an idle keep-alive connection, reconnect and try once more.
+            # other errors may happen after the server got the upload, so they are not retried
+            for attempt in range(2):
+                reused = conn is not None
+                if conn is None:
+                    conn = http.client.HTTPConnection(VRAIS_HOST, timeout=120)
+                try:
+                    status, remote_file = post_upload(conn, item["path"], headers)
+                except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError) as e:
+                    conn.close()
+                    conn = None
+                    status, remote_file = None, str(e)
+                    if not reused:
+                        break
+                except FileNotFoundError as e:
+                    status, remote_file = None, str(e)
+                    break
+                except Exception as e:
+                    # e.g. a title that can't be sent as header, the item fails but the worker goes on
+                    conn.close()
+                    conn = None
+                    status, remote_file = None, str(e)
+                    break
+                else:
+                    break
+            if status == 200:
+                print ("uploaded ", remote_file)
+                self.finish_item(item, 'DONE', str(remote_file))
+            else:
+                print ("upload of %s failed: %s" % (item["path"], remote_file))
+                self.finish_item(item, 'FAILED', str(remote_file))
+        if conn is not None:
+            conn.close()
+
+
+upload_queue = None
+
+
+# the probes are rendered at this percentage of the final resolution and with these samples
+PROBE_PERCENTAGE = 10
+PROBE_SAMPLES = 16
+
+# rotations of the camera for the 6 cubemap faces, in local camera space
+CUBE_FACE_ROTATIONS = (
+    Matrix.Identity(4),
+    Matrix.Rotation(radians(-90), 4, 'Y'),
+    Matrix.Rotation(radians(180), 4, 'Y'),
+    Matrix.Rotation(radians(90), 4, 'Y'),
+    Matrix.Rotation(radians(90), 4, 'X'),
+    Matrix.Rotation(radians(-90), 4, 'X'),
+    )
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return "%dh %dm" % (hours, minutes)
+    return "%dm %ds" % (minutes, seconds)
+
+
+def render_probe(scn, samples):
+    scn.cycles.samples = samples
+    start = time.time()
+    bpy.ops.render.render()
+    return time.time() - start
+
+
+# render a probe with 1 and with PROBE_SAMPLES samples.
+# the first one is mostly scene preparation, the difference is the time spent sampling.
+# returns the preparation time and the time per sample and pixel
+def measure_probe(scn):
+    render = scn.render
+    pixels = render.resolution_x * render.resolution_y * (render.resolution_percentage / 100.0)**2
+    overhead = render_probe(scn, 1)
+    sampling = render_probe(scn, PROBE_SAMPLES) - overhead
+    return overhead, max(sampling, 0.0) / ((PROBE_SAMPLES - 1) * pixels)
+
+
+# estimate the render time of the full stereo rendering in both VR layouts.
+# the probes are rendered from a temporary camera without animation, constraints or parent,
+# because rendering evaluates the scene camera again and would undo its face rotations.
+# all settings are restored afterwards.
+# returns a dict with (seconds, pixels) for each layout
+def estimate_vr_layouts(scn):
+    render = scn.render
+    samples = scn.cycles.samples
+    stored = [(owner, attr, getattr(owner, attr)) for owner, attr in (
+        (render, "engine"),
+        (render, "resolution_x"),
+        (render, "resolution_y"),
+        (render, "resolution_percentage"),
+        (render, "use_multiview"),
+        (render, "use_compositing"),
+        (render, "use_sequencer"),
+        (scn, "camera"),
+        (scn.cycles, "samples"),
+        )]
+    matrix = scn.camera.matrix_world.copy()
+    cam_data = scn.camera.data.copy()
+    cam_data.animation_data_clear()
+    cam = bpy.data.objects.new("vrais_probe_camera", cam_data)
+    scn.objects.link(cam)
+    cam.matrix_world = matrix
+    scn.camera = cam
+    estimate = {}
+    try:
+        render.engine = 'CYCLES'
+        render.resolution_percentage = PROBE_PERCENTAGE
+        # render one eye only, the other eye costs the same
+        render.use_multiview = False
+        render.use_compositing = False
+        render.use_sequencer = False
+
+        # equirectangular: one panorama per eye
+        cam_data.type = 'PANO'
+        cam_data.cycles.panorama_type = 'EQUIRECTANGULAR'
+        render.resolution_x = VRAIS_EQUI_HEIGHT * 2
+        render.resolution_y = VRAIS_EQUI_HEIGHT
+        overhead, per_sample = measure_probe(scn)
+        pixels = VRAIS_EQUI_HEIGHT * 2 * VRAIS_EQUI_HEIGHT
+        estimate['VRAIS_EQUI'] = (2 * (overhead + per_sample * pixels * samples), 2 * pixels)
+
+        # cubemap: 6 faces per eye, which can differ a lot in cost (e.g. sky and floor)
+        cam_data.type = 'PERSP'
+        cam_data.angle = radians(90)
+        render.resolution_x = VRAIS_CUBE_SIZE
+        render.resolution_y = VRAIS_CUBE_SIZE
+        pixels = VRAIS_CUBE_SIZE * VRAIS_CUBE_SIZE
+        seconds = 0.0
+        for rotation in CUBE_FACE_ROTATIONS:
+            cam.matrix_world = matrix * rotation
+            overhead, per_sample = measure_probe(scn)
+            seconds += overhead + per_sample * pixels * samples
+        estimate['VRAIS_CUBE'] = (2 * seconds, 12 * pixels)
+    finally:
+        for owner, attr, value in stored:
+            setattr(owner, attr, value)
+        bpy.data.objects.remove(cam, do_unlink=True)
+        bpy.data.cameras.remove(cam_data)
+    return estimate
+
+
 # check if the cubemap addon is enable in User Prefs
 def check_cubemap_addon():
     addon = "render_cube_map"
@@ -260,7 +713,7 @@ class VRAIS_OT_setup_cubemap(bpy.types.Operator):
         cam_data = scn.camera.data
 
         render.engine = 'CYCLES'
-        render.resolution_y = 1280 # recommended resolution for VRAIS
+        render.resolution_y = VRAIS_CUBE_SIZE
         render.resolution_x = render.resolution_y
         render.use_multiview = True
         render.image_settings.views_format = 'INDIVIDUAL'
@@ -294,7 +747,7 @@ class VRAIS_OT_setup_vr_panorama(bpy.types.Operator):
 
 
         render.engine = 'CYCLES'
-        render.resolution_y = 2048 # recommended resolution for VRAIS
+        render.resolution_y = VRAIS_EQUI_HEIGHT
         render.resolution_x = render.resolution_y * 2
         render.use_multiview = True
         render.image_settings.views_format = 'STEREO_3D'
@@ -318,6 +771,26 @@ class VRAIS_OT_setup_vr_panorama(bpy.types.Operator):
 
 
 
+class VRAIS_OT_estimate_render_time(bpy.types.Operator):
+    """Render small probes to estimate the render time of a cubemap and a VR panorama with the current samples"""
+    bl_idname = "scene.vrais_estimate_render_time"
+    bl_label = "Estimate Render Time"
+
+    @classmethod
+    def poll(cls, context):
+        return context.scene.camera and hasattr(context.scene, "cycles")
+
+    def execute(self, context):
+        scn = context.scene
+        vs = scn.vrais_settings
+        estimate = estimate_vr_layouts(scn)
+        vs.estimate_equi_time, vs.estimate_equi_pixels = estimate['VRAIS_EQUI']
+        vs.estimate_cube_time, vs.estimate_cube_pixels = estimate['VRAIS_CUBE']
+        vs.estimate_samples = scn.cycles.samples
+        return {'FINISHED'}
+
+
+
 class VRAIS_OT_create_cubemap(bpy.types.Operator):
     """Create the cubemap stripe"""
     bl_idname = "scene.vrais_create_cubemap"
@@ -342,6 +815,51 @@ class VRAIS_OT_create_cubemap(bpy.types.Operator):
 
 
 
+class VRAIS_OT_convert_panorama(bpy.types.Operator):
+    """Convert the stereo VR panorama into a cubemap stripe without rendering it again"""
+    bl_idname = "scene.vrais_convert_panorama"
+    bl_label = "Convert to Cubemap"
+
+    def execute(self, context):
+        scn = context.scene
+        vs = scn.vrais_settings
+        path = bpy.path.abspath(vs.equi_filepath)
+        try:
+            img = bpy.data.images.load(filepath=path)
+        except RuntimeError:
+            self.report({'ERROR'}, "Couldn't load the VR panorama. Please check the filepath.")
+            return {'CANCELLED'}
+
+        try:
+            if img.channels < 3:
+                self.report({'ERROR'}, "The VR panorama needs to be a color image.")
+                return {'CANCELLED'}
+            stripe = equirect_to_cubemap(image_to_array(img), vs.cube_size)
+            height, width = stripe.shape[:2]
+            cube = bpy.data.images.new("vrais_tmp_cubemap", width, height, alpha=True, float_buffer=img.is_float)
+        finally:
+            bpy.data.images.remove(img)
+
+        try:
+            pixels = np.ones((height, width, 4), dtype=np.float32)
+            pixels[..., :stripe.shape[2]] = stripe
+            pixels = pixels[::-1].ravel()
+            try:
+                cube.pixels.foreach_set(pixels)
+            except AttributeError:
+                cube.pixels[:] = pixels
+            # the cubemap is uploaded from the usual cubemap path
+            if vs.filename == "":
+                vs.filename = os.path.splitext(os.path.basename(path))[0]
+            scn.vrais_enum = 'VRAIS_CUBE'
+            save_as_jpeg(scn, cube, bpy.path.abspath(configure_vrais_cubemap_path(scn)), vs.jpeg_quality)
+        finally:
+            bpy.data.images.remove(cube)
+
+        return {'FINISHED'}
+
+
+
 class VRAIS_OT_uploader(bpy.types.Operator):
     """Upload to vrais.io"""
     bl_idname = "scene.vrais_uploader"
@@ -358,32 +876,17 @@ class VRAIS_OT_uploader(bpy.types.Operator):
             path = bpy.path.abspath(vs.equi_filepath)
 
         # check if camera, title and description are setup correctly
-        if not scn.camera.data.stereo.use_spherical_stereo:
-            self.report(
-                {'ERROR'}, 
-                "Spherical Stereo was not enabled in camera settings. \
-                This will lead to wrong stereo effect!"
-                )
-            return {'CANCELLED'}
-        elif len(vs.description)==0:
-            self.report(
-                {'ERROR'}, 
-                "Please fill in a description"
-                )
-            return {'CANCELLED'}
-        elif len(vs.vrais_title)==0:
-            self.report(
-                {'ERROR'}, 
-                "Please fill in a Title"
-                )
-            return {'CANCELLED'}
-        elif len(context.user_preferences.addons[__name__].preferences.vrais_key)<2:
-            self.report(
-                {'ERROR'}, 
-                "No VRAIS API key configured in Addon Preferences!"
-                )
+        error = check_upload_settings(context)
+        if error:
+            self.report({'ERROR'}, error)
             return {'CANCELLED'}
         else:
+            if vs.use_transcode:
+                try:
+                    path = transcode_for_upload(scn, path)
+                except (OSError, RuntimeError) as e:
+                    self.report({'ERROR'}, "Could not transcode %s: %s" % (path, e))
+                    return {'CANCELLED'}
             # if all is fine, upload the VR rendering
             self.report(
                 {'INFO'},
@@ -394,6 +897,111 @@ class VRAIS_OT_uploader(bpy.types.Operator):
  
 
 
+class VRAIS_OT_upload_queue_add(bpy.types.Operator):
+    """Add the current VR rendering or all images of the queue folder to the upload queue"""
+    bl_idname = "scene.vrais_upload_queue_add"
+    bl_label = "Add to Upload Queue"
+
+    use_folder = BoolProperty(default=False)
+
+    def execute(self, context):
+        scn = context.scene
+        vs = scn.vrais_settings
+
+        error = check_upload_settings(context)
+        if error:
+            self.report({'ERROR'}, error)
+            return {'CANCELLED'}
+
+        if self.use_folder:
+            folder = bpy.path.abspath(vs.queue_folder)
+            if not os.path.isdir(folder):
+                self.report({'ERROR'}, "Please choose a folder with VR renderings")
+                return {'CANCELLED'}
+            paths = [os.path.join(folder, f) for f in sorted(os.listdir(folder))
+                if f.lower().endswith(VRAIS_IMAGE_TYPES)]
+        elif scn.vrais_enum == 'VRAIS_CUBE':
+            paths = [bpy.path.abspath(configure_vrais_cubemap_path(scn))]
+        else:
+            paths = [bpy.path.abspath(vs.equi_filepath)]
+
+        added = 0
+        for path in paths:
+            # give every image of a batch its own title
+            if self.use_folder:
+                title = "%s - %s" % (vs.vrais_title, os.path.splitext(os.path.basename(path))[0])
+            else:
+                title = vs.vrais_title
+            if vs.use_transcode:
+                try:
+                    path = transcode_for_upload(scn, path)
+                except (OSError, RuntimeError) as e:
+                    self.report({'WARNING'}, "Could not transcode %s: %s" % (path, e))
+                    continue
+            if upload_queue.add(path, upload_headers(scn, title)):
+                added += 1
+
+        self.report({'INFO'}, "Added %d images to the upload queue" % added)
+        return {'FINISHED'}
+
+
+
+class VRAIS_OT_upload_queue_start(bpy.types.Operator):
+    """Upload all pending images of the queue to vrais.io"""
+    bl_idname = "scene.vrais_upload_queue_start"
+    bl_label = "Start Upload Queue"
+
+    _timer = None
+
+    @classmethod
+    def poll(cls, context):
+        return upload_queue.count('PENDING') and not upload_queue.is_running()
+
+    def modal(self, context, event):
+        if event.type == 'TIMER':
+            # redraw the panel to show the progress
+            for area in context.screen.areas:
+                if area.type == 'PROPERTIES':
+                    area.tag_redraw()
+            if not upload_queue.is_running():
+                context.window_manager.event_timer_remove(self._timer)
+                self.report(
+                    {'INFO'},
+                    "Upload queue finished, %d failed" % upload_queue.count('FAILED')
+                    )
+                return {'FINISHED'}
+        return {'PASS_THROUGH'}
+
+    def execute(self, context):
+        key = get_vrais_key(context)
+        if len(key)<2:
+            self.report({'ERROR'}, "No VRAIS API key configured in Addon Preferences!")
+            return {'CANCELLED'}
+        upload_queue.start(key, context.scene.vrais_settings.upload_workers)
+
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(0.5, context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+
+
+class VRAIS_OT_upload_queue_clear(bpy.types.Operator):
+    """Remove uploaded images from the queue and retry the failed ones"""
+    bl_idname = "scene.vrais_upload_queue_clear"
+    bl_label = "Clean Up Upload Queue"
+
+    @classmethod
+    def poll(cls, context):
+        return not upload_queue.is_running()
+
+    def execute(self, context):
+        upload_queue.clear_finished()
+        upload_queue.retry_failed()
+        return {'FINISHED'}
+
+
+
 # ##########################################################
 # UI
 ## ##########################################################
@@ -418,6 +1026,19 @@ class RENDER_PT_vrais_tools(bpy.types.Panel):
         row.operator("scene.vrais_setup_cubemap")
         row.operator("scene.vrais_setup_vr_panorama")
 
+        col = layout.column(align=True)
+        col.operator("scene.vrais_estimate_render_time", icon="TIME")
+        if vs.estimate_samples:
+            col.label(text="Equirectangular: %s, %.1f MP" % (
+                format_duration(vs.estimate_equi_time), vs.estimate_equi_pixels / 1e6))
+            col.label(text="Cubemap: %s, %.1f MP" % (
+                format_duration(vs.estimate_cube_time), vs.estimate_cube_pixels / 1e6))
+            if vs.estimate_cube_time < vs.estimate_equi_time:
+                cheaper, saving = "Cubemap", 1 - vs.estimate_cube_time / vs.estimate_equi_time
+            else:
+                cheaper, saving = "Equirectangular", 1 - vs.estimate_equi_time / max(vs.estimate_cube_time, 1e-6)
+            col.label(text="%s saves %d%% at %d samples" % (cheaper, saving * 100, vs.estimate_samples))
+
         layout.label(text="VRAIS upload configuration")
         col = layout.column()
         col.prop(scn, "vrais_enum", text="VR Type")
@@ -431,8 +1052,33 @@ class RENDER_PT_vrais_tools(bpy.types.Panel):
             col.operator("scene.vrais_uploader", text="Upload Cubemap", icon="FILE_TICK")
         else:
             col.prop(vs, 'equi_filepath')
+            row = col.row(align=True)
+            row.operator("scene.vrais_convert_panorama", icon="IMAGE_DATA")
+            row.prop(vs, 'cube_size')
             col.operator("scene.vrais_uploader", text="Upload VR Panorama", icon="FILE_TICK")
 
+        row = layout.row(align=True)
+        row.prop(vs, 'use_transcode')
+        sub = row.row(align=True)
+        sub.active = vs.use_transcode
+        sub.prop(vs, 'jpeg_quality')
+
+        layout.label(text="Upload Queue")
+        col = layout.column()
+        col.prop(vs, 'queue_folder')
+        col.prop(vs, 'upload_workers')
+        row = col.row(align=True)
+        row.operator("scene.vrais_upload_queue_add", text="Add Current").use_folder = False
+        row.operator("scene.vrais_upload_queue_add", text="Add Folder").use_folder = True
+        row = col.row(align=True)
+        row.operator("scene.vrais_upload_queue_start", icon="FILE_TICK")
+        row.operator("scene.vrais_upload_queue_clear", text="", icon="X")
+        col.label(text="%d pending, %d uploaded, %d failed" % (
+            upload_queue.count('PENDING') + upload_queue.count('UPLOADING'),
+            upload_queue.count('DONE'),
+            upload_queue.count('FAILED')
+            ))
+
 
 
 # ##########################################################
@@ -464,6 +1110,44 @@ class VraisSettings(bpy.types.PropertyGroup):
         description="Here's where the Cubemap will be generated (and loaded)", 
         subtype='DIR_PATH',
         default="//../")
+    cube_size = IntProperty(
+        name="Face Size",
+        description="Resolution of the cubemap faces when converting a VR panorama",
+        default=VRAIS_CUBE_SIZE,
+        min=64,
+        max=8192)
+    estimate_samples = IntProperty(
+        name="Estimated Samples",
+        description="Samples the render time was estimated for")
+    estimate_equi_time = FloatProperty(
+        name="Equirectangular Render Time in Seconds")
+    estimate_equi_pixels = IntProperty(
+        name="Equirectangular Pixels")
+    estimate_cube_time = FloatProperty(
+        name="Cubemap Render Time in Seconds")
+    estimate_cube_pixels = IntProperty(
+        name="Cubemap Pixels")
+    use_transcode = BoolProperty(
+        name="Transcode to JPEG",
+        description="Convert the image to a JPEG in the recommended VRAIS resolution before uploading",
+        default=False)
+    jpeg_quality = IntProperty(
+        name="Quality",
+        description="JPEG quality of the transcoded image",
+        default=90,
+        min=10,
+        max=100,
+        subtype='PERCENTAGE')
+    queue_folder = StringProperty(
+        name="Queue Folder",
+        description="Folder with VR renderings to add to the upload queue",
+        subtype='DIR_PATH')
+    upload_workers = IntProperty(
+        name="Parallel Uploads",
+        description="How many images are uploaded at the same time",
+        default=2,
+        min=1,
+        max=8)
 
 
 
@@ -476,16 +1160,26 @@ classes = (
     VraisTools,
     VraisSettings,
     VRAIS_OT_uploader,
+    VRAIS_OT_upload_queue_add,
+    VRAIS_OT_upload_queue_start,
+    VRAIS_OT_upload_queue_clear,
     VRAIS_OT_setup_cubemap,
     VRAIS_OT_create_cubemap,
+    VRAIS_OT_convert_panorama,
+    VRAIS_OT_estimate_render_time,
     VRAIS_OT_setup_vr_panorama,
     RENDER_PT_vrais_tools
     )
 
 def register():
+    global upload_queue
     for c in classes:
         register_class(c)
 
+    # resume the upload queue of the last session
+    upload_queue = VraisUploadQueue(upload_queue_path())
+    upload_queue.load()
+
     bpy.types.Scene.vrais_settings = PointerProperty(type=VraisSettings)
     bpy.types.Scene.vrais_enum = bpy.props.EnumProperty(
         items=(